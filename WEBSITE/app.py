@@ -2,6 +2,10 @@ import sys
 import os
 import math
 import time
+import threading
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as SearchTimeout
 
 # get filepath relative to the project so that it will run on any system
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -9,42 +13,154 @@ rsms_dir = os.path.join(base_dir, 'Road-Safety-Monitoring-System')
 path_to_insert = rsms_dir if os.path.isdir(rsms_dir) else base_dir
 sys.path.insert(0, path_to_insert)
 
-from flask import Flask, render_template, request, jsonify
-from create_nodes import open_images, parse_metadata
-from create_graph import create_graph
-from coordinate_conversion import dms_to_decimal
+from flask import Flask, Response, render_template, request, jsonify
+from graph_snapshot import DEFAULT_MODEL_PATH, load_graph, updatable_graph
+from csr_graph import as_csr
+from weight_profiles import PROFILES, edge_weights, penalty_factor, prepare_profiles, profile_name
+from route_cache import RouteCache
+from search_trace import SearchTrace
 from dijkstra_search import Dijkstra
 from a_star_search import A_star
+from route_matrix import route_matrix, group_by_start, start_routes
+from contraction_hierarchy import CH_search, contraction_hierarchy
+from landmarks import ALT_search, landmarks
+from pareto_search import pareto_search, DEFAULT_MAX_LABELS, DEFAULT_MAX_ROUTES
+from alternative_routes import alternative_routes
+from isochrone import isochrone
+
+# Searches run on a small thread pool so a request can give up on a slow one
+SEARCH_THREADS = 8
+SEARCH_TIMEOUT_S = 10.0
+# Most routes a pareto request can ask for
+MAX_ROUTES_LIMIT = 20
+# Most queries one /routes/batch request may hold
+MAX_BATCH_QUERIES = 10000
 
 app = Flask(__name__)
 
-# load nodes and graph once on startup
-images = open_images()
-nodes = parse_metadata(images)
-for n in nodes.values():
-    n.coordinate = dms_to_decimal(n.coordinate)
-graph = create_graph()
-graph.build_graph(nodes)
-
-def distance(a, b):
-    R = 6371000.0
-    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
-    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
-    dlat, dlon = lat2 - lat1, lon2 - lon1
-    sa = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
-    return 2 * R * math.asin(math.sqrt(sa))
+# Set by load_app (memory-mapped from the compiled snapshot when it is up to date).
+# Running app.py loads everything before serving. A WSGI server that only imports the module
+# (gunicorn app:app, flask run) starts the load in the background on the first request, or
+# can use the factory instead: gunicorn 'app:create_app()'
+graph = None
+nodes = None
+ready = threading.Event()
+loading = False
+load_lock = threading.Lock()
+# Uploads patch the graph of one process only, so they are turned off when serving from forked
+# workers (--workers, or create_app(uploads=False) under a multi-process WSGI server)
+uploads_enabled = True
+
+# Rescans nodes when new photos are uploaded (the AI model is loaded on the first upload
+# unless load_app preloads it)
+model_path = DEFAULT_MODEL_PATH
+updater = None
+update_lock = threading.Lock()
+
+_search_pool = None
+_search_pool_pid = None
+
+# Recent /route results; those that read the safety scores go stale when the weights change
+route_cache = RouteCache()
+
+def load_app(preload_model=False, warm=True, model=None):
+    """
+    Loads the graph (and optionally the AI model) and marks the app ready for /health.
+    model is the classifier the graph is scored with and uploads are rescanned with
+    (.pt or .onnx, default DEFAULT_MODEL_PATH).
+    warm=True also prepares the weight profiles and their contraction hierarchies and
+    landmarks, so forked workers share them instead of each building their own on the first request.
+    """
+    global graph, nodes, updater, loading, model_path
+    with load_lock:
+        loading = True
+    if model:
+        model_path = model
+    graph = load_graph(model_path)
+    nodes = graph.nodes
+    if warm:
+        prepare_profiles(graph)
+        for name in PROFILES:
+            contraction_hierarchy(graph, profile=name)
+            landmarks(graph, profile=name)
+    if preload_model:
+        updater = updatable_graph(graph, model_path)
+    ready.set()
+
+def start_loading():
+    # Loads the app in a background thread unless it is loaded or loading already
+    global loading
+    with load_lock:
+        if loading or ready.is_set():
+            return
+        loading = True
+
+    def load():
+        global loading
+        try:
+            load_app()
+        except Exception as e:
+            # The next request tries again
+            print(f"Error loading the graph: {e}")
+            with load_lock:
+                loading = False
+
+    threading.Thread(target=load, daemon=True).start()
+
+def create_app(preload_model=False, warm=True, uploads=True, model=None):
+    # App factory for WSGI servers: loads everything before the first request is served
+    global uploads_enabled
+    uploads_enabled = uploads
+    load_app(preload_model=preload_model, warm=warm, model=model)
+    return app
+
+def search_pool():
+    # Threads don't survive a fork, so every worker process makes its own pool
+    global _search_pool, _search_pool_pid
+    if _search_pool is None or _search_pool_pid != os.getpid():
+        _search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS)
+        _search_pool_pid = os.getpid()
+    return _search_pool
+
+def run_search(function, *args, **kwargs):
+    # Raises SearchTimeout if the search takes longer than SEARCH_TIMEOUT_S
+    return search_pool().submit(function, *args, **kwargs).result(timeout=SEARCH_TIMEOUT_S)
 
 def nearest_node(coord):
-    try:
-        return min(nodes.values(), key=lambda n: distance(coord, n.coordinate))
-    except ValueError:
+    found = graph.nearest(coord, k=1)
+    if not found:
         return None
+    node_id, _ = found[0]
+    return nodes[node_id]
 
 def resolve_node(value):
     if isinstance(value, (list, tuple)):
         return nearest_node(value)
     return nodes.get(value)
 
+@app.before_request
+def wait_for_graph():
+    # Only the page itself and the readiness check work while the graph is loading
+    if not ready.is_set():
+        start_loading()
+        if request.endpoint not in ("home", "health", "static"):
+            return jsonify({"error": "Graph is still loading"}), 503
+
+@app.route("/health", methods=["GET"])
+def health():
+    if not ready.is_set():
+        return jsonify({"status": "loading"}), 503
+    csr = as_csr(graph)
+    return jsonify({
+        "status": "ready",
+        "pid": os.getpid(),
+        "nodes": csr.node_count,
+        "edges": csr.edge_count,
+        "graph_version": csr.version,
+        "model_loaded": bool(updater is not None and updater.scanner),
+        "uploads_enabled": uploads_enabled
+    })
+
 @app.route("/")
 def home():
     return render_template("index.html")
@@ -55,6 +171,50 @@ def route():
     start = data.get("start")
     end = data.get("end")
     algo = data.get("algo", "astar")
+    # profile: shortest, balanced (default), safest or a custom penalty factor (see weight_profiles.py)
+    profile = data.get("profile")
+    # as_of_year weighs the roads by the photos taken up to that year (A* and Dijkstra)
+    as_of_year = data.get("as_of_year")
+    # debug=true returns what the search did (A* and Dijkstra), and always runs a fresh search
+    trace = SearchTrace() if data.get("debug") else None
+    # algo=pareto returns up to max_routes routes from the shortest to the safest, expanding at
+    # most max_labels labels (fewer answer sooner, with fewer routes between the two ends)
+    max_routes = data.get("max_routes", DEFAULT_MAX_ROUTES)
+    max_labels = data.get("max_labels", DEFAULT_MAX_LABELS)
+    # alternatives=N adds up to N different routes to an A* or Dijkstra route
+    alternatives = data.get("alternatives", 0)
+
+    try:
+        max_routes = int(max_routes)
+        max_labels = int(max_labels)
+        alternatives = int(alternatives)
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_routes, max_labels and alternatives must be numbers"}), 400
+    if not 1 <= max_routes <= MAX_ROUTES_LIMIT:
+        return jsonify({"error": f"max_routes must be between 1 and {MAX_ROUTES_LIMIT}"}), 400
+    if not 0 <= max_labels <= DEFAULT_MAX_LABELS:
+        return jsonify({"error": f"max_labels must be between 0 and {DEFAULT_MAX_LABELS}"}), 400
+    if not 0 <= alternatives < MAX_ROUTES_LIMIT:
+        return jsonify({"error": f"alternatives must be between 0 and {MAX_ROUTES_LIMIT - 1}"}), 400
+    if alternatives and algo not in ("astar", "dijkstra"):
+        return jsonify({"error": "alternatives work with the astar and dijkstra algorithms"}), 400
+
+    try:
+        profile = profile_name(profile)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if algo in ("ch", "alt") and profile not in PROFILES:
+        return jsonify({"error": f"The ch and alt algorithms need one of the profiles {', '.join(PROFILES)}"}), 400
+
+    if as_of_year is not None:
+        try:
+            as_of_year = int(as_of_year)
+        except (TypeError, ValueError):
+            return jsonify({"error": "as_of_year must be a year"}), 400
+        if algo not in ("astar", "dijkstra"):
+            return jsonify({"error": "as_of_year works with the astar and dijkstra algorithms"}), 400
+        if as_csr(graph).hazard_profiles is None:
+            return jsonify({"error": "The graph has no dated images"}), 400
 
     try:
         start_node = resolve_node(start)
@@ -65,10 +225,39 @@ def route():
 
         start_time = time.time()
 
-        if algo == "dijkstra":
-            node_path, total_dist = Dijkstra(graph, start_node_id=start_node.id, end_node_id=end_node.id)
+        # The algorithm slot includes how many routes (and pareto labels) were asked for (pareto
+        # fronts ignore the profile)
+        search = (algo, (max_routes, max_labels) if algo == "pareto" else None, alternatives)
+        key = (start_node.id, end_node.id, search, profile, as_of_year)
+        # Shortest-profile routes only read the distances, so uploads never make them stale
+        # (pareto fronts always read the safety scores)
+        distance_only = penalty_factor(profile) == 0 and algo != "pareto"
+        version = None if distance_only else as_csr(graph).version
+        result = route_cache.get(key, version) if trace is None else None
+        if result is not None:
+            return jsonify(dict(result, time_s=time.time() - start_time, cached=True))
+
+        if alternatives:
+            # Both trees are grown once and priced every candidate; the best route comes first
+            routes = run_search(alternative_routes, graph, start_node.id, end_node.id, alternatives=alternatives,
+                                weights=edge_weights(graph, profile, as_of_year))
+            node_path, total_dist = (routes[0][0], routes[0][1]) if routes else ([end_node.id], float('inf'))
+        elif algo == "dijkstra":
+            node_path, total_dist = run_search(Dijkstra, graph, start_node_id=start_node.id, end_node_id=end_node.id,
+                                               trace=trace, weights=edge_weights(graph, profile, as_of_year))
+        elif algo == "ch":
+            # The contraction hierarchies are built (or loaded from their cache) by load_app
+            node_path, total_dist = run_search(CH_search, graph, start_node.id, end_node.id, profile=profile)
+        elif algo == "alt":
+            node_path, total_dist = run_search(ALT_search, graph, start_node.id, end_node.id, profile=profile)
+        elif algo == "pareto":
+            # The whole distance / hazard trade-off in one search; the main path is the shortest
+            routes, complete = run_search(pareto_search, graph, start_node.id, end_node.id, max_routes=max_routes,
+                                          max_labels=max_labels)
+            node_path, total_dist = (routes[0][0], routes[0][1]) if routes else ([end_node.id], float('inf'))
         else:
-            node_path, total_dist = A_star(graph, start_node.id, end_node.id)
+            node_path, total_dist = run_search(A_star, graph, start_node.id, end_node.id, trace=trace,
+                                               weights=edge_weights(graph, profile, as_of_year))
 
         end_time = time.time()
 
@@ -81,15 +270,253 @@ def route():
             distance_m = total_dist
             unreachable = False
 
-        return jsonify({
+        result = {
             "path": path_coords,
             "node_path": node_path,
             "distance_m": distance_m,
-            "time_s": end_time - start_time,
-            "unreachable": unreachable
+            "unreachable": unreachable,
+            "profile": profile
+        }
+        if algo == "pareto":
+            result["routes"] = [{
+                "path": [nodes[nid].coordinate for nid in route_path],
+                "node_path": route_path,
+                "distance_m": route_distance,
+                "hazard_exposure_m": exposure
+            } for route_path, route_distance, exposure in routes]
+            result["complete"] = complete
+        elif alternatives:
+            result["routes"] = [{
+                "path": [nodes[nid].coordinate for nid in route_path],
+                "node_path": route_path,
+                "distance_m": cost,
+                "length_m": length,
+                "overlap": overlap
+            } for route_path, cost, length, overlap in routes]
+        route_cache.put(key, version, result)
+
+        if trace is not None:
+            traced = algo in ("astar", "dijkstra")
+            return jsonify(dict(result, time_s=end_time - start_time, cached=False,
+                                trace=trace.as_dict() if traced else None))
+        return jsonify(dict(result, time_s=end_time - start_time, cached=False))
+    except SearchTimeout:
+        return jsonify({"error": "Search timed out"}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/route/cache", methods=["GET"])
+def route_cache_stats():
+    return jsonify(route_cache.stats())
+
+@app.route("/matrix", methods=["POST"])
+def matrix():
+    # Body: {"points": [...], "destinations": [...] (optional)}, each a node id or [lat, lon]
+    # Returns the safety-weighted cost and real distance between every origin and destination
+    data = request.json or {}
+    points = data.get("points") or []
+    destinations = data.get("destinations")
+
+    try:
+        origin_nodes = [resolve_node(p) for p in points]
+        destination_nodes = origin_nodes if destinations is None else [resolve_node(p) for p in destinations]
+
+        if not origin_nodes or any(n is None for n in origin_nodes + destination_nodes):
+            return jsonify({"error": "Invalid points"}), 400
+
+        start_time = time.time()
+        # workers=1: the server runs threads, so the matrix is never computed in forked processes
+        result = run_search(route_matrix, graph, [n.id for n in origin_nodes], [n.id for n in destination_nodes],
+                            workers=1)
+        end_time = time.time()
+
+        # JSON has no infinity, unreachable pairs are null
+        def finite_rows(rows):
+            return [[value if math.isfinite(value) else None for value in row] for row in rows]
+
+        return jsonify({
+            "origins": result["origins"],
+            "destinations": result["destinations"],
+            "cost": finite_rows(result["cost"]),
+            "distance_m": finite_rows(result["distance_m"]),
+            "time_s": end_time - start_time
+        })
+    except SearchTimeout:
+        return jsonify({"error": "Search timed out"}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/isochrone", methods=["POST"])
+def reachable():
+    # Body: {"source": node id or [lat, lon], "budget": cost, "hull": true/false (optional),
+    #        "profile" and "as_of_year" as for /route}
+    # Returns every node reachable from the source within the budget, cheapest first
+    data = request.json or {}
+    as_of_year = data.get("as_of_year")
+
+    try:
+        budget = float(data.get("budget"))
+        profile = profile_name(data.get("profile"))
+        if as_of_year is not None:
+            as_of_year = int(as_of_year)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid budget, profile or as_of_year ({e})"}), 400
+    if not math.isfinite(budget) or budget < 0:
+        return jsonify({"error": "budget must be a number of 0 or more"}), 400
+    if as_of_year is not None and as_csr(graph).hazard_profiles is None:
+        return jsonify({"error": "The graph has no dated images"}), 400
+
+    try:
+        source_node = resolve_node(data.get("source"))
+        if source_node is None:
+            return jsonify({"error": "Invalid source"}), 400
+
+        start_time = time.time()
+        result = run_search(isochrone, graph, source_node.id, budget,
+                            weights=edge_weights(graph, profile, as_of_year), hull=bool(data.get("hull")))
+        end_time = time.time()
+
+        return jsonify({
+            "source": source_node.id,
+            "budget": budget,
+            "profile": profile,
+            "nodes": [{
+                "node": node_id,
+                "coordinate": nodes[node_id].coordinate,
+                "cost": cost,
+                "distance_m": length
+            } for node_id, cost, length in result["nodes"]],
+            "hull": result["hull"],
+            "time_s": end_time - start_time
+        })
+    except SearchTimeout:
+        return jsonify({"error": "Search timed out"}), 504
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/routes/batch", methods=["POST"])
+def routes_batch():
+    # Body: {"queries": [{"start": ..., "end": ...}, ...]}, each a node id or [lat, lon]
+    # Streams one JSON line per query (same fields as /route plus "index", "start" and "end"),
+    # grouped by start node: one search tree per distinct start answers all of its queries.
+    # Every tree runs on the search pool with the same timeout as /route
+    data = request.json or {}
+    queries = data.get("queries") or []
+    if not isinstance(queries, list):
+        return jsonify({"error": "queries must be a list"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    lines = []
+    pairs = []
+    positions = []
+    for index, query in enumerate(queries):
+        start_node = resolve_node(query.get("start")) if isinstance(query, dict) else None
+        end_node = resolve_node(query.get("end")) if isinstance(query, dict) else None
+        if start_node is None or end_node is None:
+            lines.append({"index": index, "error": "Invalid start or end"})
+        else:
+            pairs.append((start_node.id, end_node.id))
+            positions.append(index)
+
+    def stream():
+        for line in lines:
+            yield json.dumps(line) + "\n"
+        for start_id, start_queries in group_by_start(graph, pairs).items():
+            try:
+                routes = run_search(start_routes, graph, start_id, start_queries)
+            except SearchTimeout:
+                for position, end_id in start_queries:
+                    yield json.dumps({"index": positions[position], "start": start_id, "end": end_id,
+                                      "error": "Search timed out"}) + "\n"
+                continue
+
+            for position, node_path, cost, _ in routes:
+                end_id = pairs[position][1]
+                unreachable = not math.isfinite(cost)
+                yield json.dumps({
+                    "index": positions[position],
+                    "start": start_id,
+                    "end": end_id,
+                    "path": [nodes[nid].coordinate for nid in node_path],
+                    "node_path": node_path,
+                    "distance_m": None if unreachable else cost,
+                    "unreachable": unreachable
+                }) + "\n"
+
+    return Response(stream(), mimetype="application/x-ndjson")
+
+@app.route("/nodes/<node_id>/images", methods=["POST"])
+def upload_node_images(node_id):
+    # Multipart form: one or more "images" files, optional "year" and "replace" fields
+    # Rescans only this node and re-weights its roads in the running graph
+    global updater
+    import cv2
+    import numpy as np
+
+    if not uploads_enabled:
+        return jsonify({"error": "Uploads need a single-process server (run app.py without --workers)"}), 409
+    if node_id not in nodes:
+        return jsonify({"error": "Unknown node"}), 404
+
+    year = request.form.get("year")
+    if year:
+        try:
+            year = int(year)
+        except ValueError:
+            return jsonify({"error": "year must be a year"}), 400
+    else:
+        year = None
+
+    new_images = []
+    for upload in request.files.getlist("images"):
+        picture = cv2.imdecode(np.frombuffer(upload.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if picture is None:
+            return jsonify({"error": f"Could not read image {upload.filename}"}), 400
+        new_images.append({"year": year, "picture": picture})
+    if not new_images:
+        return jsonify({"error": "No images"}), 400
+
+    try:
+        start_time = time.time()
+        with update_lock:
+            if updater is None or updater.scanner is None:
+                # Tried again on every upload until the model loads
+                updater = updatable_graph(graph, model_path)
+                if updater.scanner is None:
+                    return jsonify({"error": "The AI model could not be loaded, images can't be scored"}), 503
+            score = updater.update_node_images(node_id, new_images,
+                                               replace=request.form.get("replace") == "true")
+        end_time = time.time()
+
+        return jsonify({
+            "node": node_id,
+            "safety_score": score,
+            "graph_version": as_csr(graph).version,
+            "time_s": end_time - start_time
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the route planner website")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Serve from this many forked processes (default: Flask debug server). "
+                             "Image uploads (POST /nodes/<id>/images) are turned off in this mode, "
+                             "since each worker would only re-weight its own copy of the graph")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="Hazard classifier weights, .pt (ultralytics) or .onnx (onnxruntime)")
+    parser.add_argument('--preload-model', action='store_true',
+                        help="Load the AI model at startup instead of on the first image upload")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        from prefork import serve_prefork
+        uploads_enabled = False
+        load_app(preload_model=args.preload_model, model=args.model)
+        serve_prefork(app, args.host, args.port, args.workers)
+    else:
+        load_app(preload_model=args.preload_model, warm=False, model=args.model)
+        app.run(host=args.host, port=args.port, debug=True)
@@ -0,0 +1,67 @@
+# This file serves the Flask app from several processes at once.
+# The master process loads everything first (graph snapshot, search structures), opens the
+# listening socket and then forks the workers. Forked workers share the master's memory
+# copy-on-write, so the graph is held in RAM once no matter how many workers there are, and
+# the kernel hands every incoming connection on the shared socket to one of them.
+# Each worker runs a threaded werkzeug server, and dead workers are replaced by the master.
+
+import os
+import signal
+import time
+
+from werkzeug.serving import make_server
+
+# Wait before replacing a worker that died, so a crashing worker doesn't spin the master
+RESPAWN_DELAY_S = 1.0
+
+
+def serve_prefork(app, host='127.0.0.1', port=5000, workers=2):
+    """
+    Runs app on host:port with the given number of forked worker processes until the
+    master gets SIGINT or SIGTERM. Only works where os.fork exists (Linux, macOS).
+    """
+    server = make_server(host, port, app, threaded=True)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Worker: leave quietly when the master stops it (or on Ctrl-C in the terminal)
+            signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+            signal.signal(signal.SIGINT, lambda signum, frame: os._exit(0))
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} worker processes (master pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited, starting a new one")
+            time.sleep(RESPAWN_DELAY_S)
+        if not stopping:
+            spawn()
+
+    server.server_close()
@@ -6,6 +6,13 @@ L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
 
 let markers = [];
 let currentPolyline = null;
+// Extra routes (pareto fronts and alternatives), drawn under the main one
+let alternativeLines = [];
+
+function clearAlternatives() {
+    alternativeLines.forEach(line => map.removeLayer(line));
+    alternativeLines = [];
+}
 
 map.on('click', function(e) {
     if (markers.length === 2) {
@@ -17,6 +24,7 @@ map.on('click', function(e) {
             map.removeLayer(currentPolyline);
             currentPolyline = null;
         }
+        clearAlternatives();
     }
 
     markers.push(L.marker(e.latlng).addTo(map));
@@ -34,11 +42,14 @@ function go() {
     
     // get selected algo from the UI if available
     const algo = (window.getSelectedAlgorithm && typeof window.getSelectedAlgorithm === 'function') ? getSelectedAlgorithm() : 'astar';
+    // two alternative routes when asked for (only A* and Dijkstra can add them)
+    const wantAlternatives = document.getElementById('alternatives')?.checked && (algo === 'astar' || algo === 'dijkstra');
+    const alternatives = wantAlternatives ? 2 : 0;
 
     fetch("/route", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ start, end, algo })
+        body: JSON.stringify({ start, end, algo, alternatives })
     })
     .then(res => res.json())
     .then(data => {
@@ -52,6 +63,13 @@ function go() {
             map.removeLayer(currentPolyline);
             currentPolyline = null;
         }
+        clearAlternatives();
+
+        // other routes (the last route of a pareto front is the safest one)
+        (data.routes || []).slice(1).forEach((route, i, rest) => {
+            const color = algo === 'pareto' && i === rest.length - 1 ? 'green' : 'orange';
+            alternativeLines.push(L.polyline(route.path, {color: color, weight: 3, dashArray: '6 6'}).addTo(map));
+        });
 
         // draw line
         currentPolyline = L.polyline(data.path, {color: 'blue'}).addTo(map);
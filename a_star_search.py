@@ -1,52 +1,105 @@
 #This file is the implementation of the A* algorithm to find the best/shortest path
 
 import heapq
-import math
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
-def A_star(graph, start: str, goal: str) -> Tuple[List[str], float]:
-    #Run A* on the graph from the start node to the goal node
-    #Returns (path_list, total_cost)
-    #If the goal is unreachable, returns ([goal], float('inf'))
+from csr_graph import as_csr
+from geodesic import heuristic_to
+from search_trace import SearchTrace
 
-    #Euclidean distance heuristic between two nodes
-    #returns 0.0 on error
-    def euclidean_distance_heuristic(a, b):
-        try:
-            a_x, a_y = graph.nodes[a].coordinate
-            b_x, b_y = graph.nodes[b].coordinate
-            return math.hypot(a_x - b_x, a_y - b_y)
-        except Exception:
-            return 0.0
-
-    open_heap = [(euclidean_distance_heuristic(start, goal), start)]
-    predecessor = {}    #maps node_id to parent node_id for path reconstruction step
-    best_cost = {node_id: float('inf') for node_id in graph.nodes}
-    best_cost[start] = 0.0
-
-    #expands nodes
+def _expand(open_heap, best_cost, predecessor, offsets, targets, weights, heuristic, goal_index):
+    #The search loop without a trace: nothing but the search itself
     while open_heap:
-        _, current = heapq.heappop(open_heap)
-        if current == goal:
+        _, cost, current = heapq.heappop(open_heap)
+        if current == goal_index:
             # Exit when goal is popped
             break
+        if cost > best_cost[current]:
+            # Stale heap entry, a cheaper path to this node was already expanded
+            continue
 
         # Check each neighbor of current node
-        for neighbor, edge in graph.adjacency.get(current, {}).items():
-            weight = edge.get('weight', edge.get('distance', 1))
-            temp = best_cost[current] + weight
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            temp = cost + weights[e]
 
             #if the path is better, push to heap
-            if temp < best_cost.get(neighbor, float('inf')):
+            if temp < best_cost[neighbor]:
+                predecessor[neighbor] = current
+                best_cost[neighbor] = temp
+                heapq.heappush(open_heap, (temp + heuristic[neighbor], temp, neighbor))
+
+def _expand_traced(open_heap, best_cost, predecessor, offsets, targets, weights, heuristic, goal_index):
+    #The same loop, counting what it does; returns (popped, relaxed, stale)
+    popped = relaxed = stale = 0
+    while open_heap:
+        _, cost, current = heapq.heappop(open_heap)
+        popped += 1
+        if current == goal_index:
+            break
+        if cost > best_cost[current]:
+            stale += 1
+            continue
+
+        first, last = offsets[current], offsets[current + 1]
+        relaxed += last - first
+        for e in range(first, last):
+            neighbor = targets[e]
+            temp = cost + weights[e]
+            if temp < best_cost[neighbor]:
                 predecessor[neighbor] = current
                 best_cost[neighbor] = temp
-                heapq.heappush(open_heap, (temp + euclidean_distance_heuristic(neighbor, goal), neighbor))
+                heapq.heappush(open_heap, (temp + heuristic[neighbor], temp, neighbor))
+    return popped, relaxed, stale
+
+def A_star(graph, start: str, goal: str, trace: Optional[SearchTrace] = None,
+           weights=None) -> Tuple[List[str], float]:
+    #Run A* on the graph from the start node to the goal node
+    #Works on the integer-indexed CSR arrays of the graph (see csr_graph.py)
+    #Pass trace=SearchTrace() to record what the search did (see search_trace.py)
+    #weights replaces the graph's edge weights (e.g. weight_profiles.edge_weights); every
+    #weight must be at least the edge's distance
+    #Returns (path_list, total_cost)
+    #If the goal is unreachable, returns ([goal], float('inf'))
+    if trace is not None:
+        trace.start()
+    csr = as_csr(graph)
+    if start not in csr.index or goal not in csr.index:
+        return [goal], float('inf')
+
+    start_index = csr.index[start]
+    goal_index = csr.index[goal]
+    offsets, targets = csr.offsets, csr.targets
+    if weights is None:
+        weights = csr.weight
+    scale = csr.heuristic_scale if weights is csr.weight else csr.distance_scale
+
+    #Great-circle distance (metres) from every node to the goal, computed once per search
+    #Scaled so it never overestimates an edge weight, which keeps the heuristic admissible
+    heuristic = heuristic_to(csr, goal_index, scale)
+    if trace is not None:
+        trace.mark('heuristic')
+
+    open_heap = [(heuristic[start_index], 0.0, start_index)]
+    predecessor = {}    #maps node index to parent node index for path reconstruction step
+    best_cost = [float('inf')] * csr.node_count
+    best_cost[start_index] = 0.0
+
+    #expands nodes (the counting loop only runs when the search is traced)
+    if trace is None:
+        _expand(open_heap, best_cost, predecessor, offsets, targets, weights, heuristic, goal_index)
+    else:
+        popped, relaxed, stale = _expand_traced(open_heap, best_cost, predecessor, offsets, targets,
+                                                weights, heuristic, goal_index)
+        trace.mark('search')
+        # Every pushed entry was either popped or is still on the heap
+        trace.count(popped, relaxed, popped + len(open_heap), stale)
 
     #Reconstruct the path
     path = []
-    current_node = goal
+    current_node = goal_index
 
-    if best_cost.get(goal, float('inf')) == float('inf'):
+    if best_cost[goal_index] == float('inf'):
         return [goal], float('inf')
     
     while current_node is not None:
@@ -55,4 +108,6 @@ def A_star(graph, start: str, goal: str) -> Tuple[List[str], float]:
 
     #swap from GOAL to START to START to GOAL
     path.reverse()
-    return path, best_cost[goal]
\ No newline at end of file
+    if trace is not None:
+        trace.mark('path')
+    return csr.path_ids(path), best_cost[goal_index]
@@ -0,0 +1,124 @@
+# This file finds a few meaningfully different routes besides the best one, e.g. to offer a
+# way around a hazardous intersection. It uses the "via node" method: one shortest path tree
+# from the start and one reverse tree into the goal give, for every node v at once, the best
+# route start -> v -> goal (the two tree paths glued together). Two searches therefore price
+# every candidate; no search is rerun per alternative. A first search, stopped at the goal,
+# gives the best cost and with it the limit, max_stretch times that cost. The reverse tree
+# stops at the limit, and the forward tree only grows through nodes v whose cost from the
+# start plus reverse cost to the goal is within it: every node on the tree path to an
+# acceptable via node passes that test, so nothing else is ever needed.
+#
+# Candidates are tried from the cheapest up and accepted when they
+#   - cost at most max_stretch times the best route,
+#   - visit no node twice (gluing two tree paths can make a loop), and
+#   - share at most max_overlap of their length with every route accepted before.
+# Many via nodes give the same route, the overlap test drops the repeats.
+
+from csr_graph import as_csr
+from dijkstra_search import shortest_path_tree, reverse_shortest_path_tree
+
+DEFAULT_ALTERNATIVES = 2
+# Share of an alternative's length it may have in common with any other route
+DEFAULT_MAX_OVERLAP = 0.7
+# How much more an alternative may cost than the best route
+DEFAULT_MAX_STRETCH = 1.5
+
+
+def _via_route(v, previous, following):
+    # Node indexes of the tree route start -> v -> goal
+    path = []
+    current = v
+    while current != -1:
+        path.append(current)
+        current = previous[current]
+    path.reverse()
+    current = following[v]
+    while current != -1:
+        path.append(current)
+        current = following[current]
+    return path
+
+
+def _edge_lengths(path, forward_lengths, backward_lengths, v):
+    # (u, w) -> metres for every edge of a via route, read off the two trees
+    edges = {}
+    via = path.index(v)
+    for position in range(len(path) - 1):
+        u, w = path[position], path[position + 1]
+        if position < via:
+            edges[(u, w)] = forward_lengths[w] - forward_lengths[u]
+        else:
+            edges[(u, w)] = backward_lengths[u] - backward_lengths[w]
+    return edges
+
+
+def alternative_routes(graph, start, goal, alternatives=DEFAULT_ALTERNATIVES, max_overlap=DEFAULT_MAX_OVERLAP,
+                       max_stretch=DEFAULT_MAX_STRETCH, weights=None):
+    """
+    Finds the best route and up to `alternatives` different ones.
+
+    Args:
+        graph: The built graph (create_graph or CSRGraph).
+        start, goal (str): Node ids.
+        alternatives (int): How many routes to look for besides the best one.
+        max_overlap (float): Largest share (0-1) of a route's length it may have in common
+                             with each route accepted before it.
+        max_stretch (float): Largest cost of an alternative as a multiple of the best cost.
+        weights: Edge weights (e.g. weight_profiles.edge_weights), defaults to the graph's.
+
+    Returns:
+        list: (path_list, cost, distance_m, overlap) per route, the best route first. overlap
+        is the share of the route's length shared with the best route. Empty if the goal is
+        unreachable.
+    """
+    csr = as_csr(graph)
+    if start not in csr.index or goal not in csr.index:
+        return []
+
+    goal_index = csr.index[goal]
+    best_cost = shortest_path_tree(csr, start, targets=[goal], weights=weights)[0][goal_index]
+    if best_cost == float('inf'):
+        return []
+    limit = best_cost * max_stretch
+    backward_costs, backward_lengths, following = reverse_shortest_path_tree(csr, goal, weights=weights,
+                                                                             limit=limit)
+    forward_costs, forward_lengths, previous = shortest_path_tree(csr, start, weights=weights, limit=limit,
+                                                                  bounds=backward_costs)
+
+    best_path = _via_route(goal_index, previous, following)
+    best_edges = _edge_lengths(best_path, forward_lengths, backward_lengths, goal_index)
+    routes = [(best_path, best_cost, forward_lengths[goal_index], best_edges)]
+    on_best = set(best_path)
+
+    candidates = sorted(
+        (forward_costs[v] + backward_costs[v], v) for v in range(csr.node_count)
+        if v not in on_best and forward_costs[v] + backward_costs[v] <= limit
+    )
+
+    used = set(on_best)
+    for cost, v in candidates:
+        if len(routes) > alternatives:
+            break
+        # Via nodes on an accepted route (almost always) give that same route again
+        if v in used:
+            continue
+        path = _via_route(v, previous, following)
+        if len(set(path)) != len(path):
+            continue
+
+        edges = _edge_lengths(path, forward_lengths, backward_lengths, v)
+        length = sum(edges.values())
+        if length > 0 and any(
+            sum(metres for edge, metres in edges.items() if edge in other) > max_overlap * length
+            for _, _, _, other in routes
+        ):
+            continue
+        routes.append((path, cost, forward_lengths[v] + backward_lengths[v], edges))
+        used.update(path)
+
+    result = []
+    for path, cost, distance, edges in routes:
+        length = sum(edges.values())
+        shared = sum(metres for edge, metres in edges.items() if edge in best_edges)
+        result.append((csr.path_ids(path), cost, distance, shared / length if length > 0 else 1.0))
+    return result
@@ -0,0 +1,186 @@
+# This file measures how fast the hazard classifier (cv_inference.RoadScanner) scores images,
+# to pick the batch size and thread count for a machine. Everything runs on the CPU.
+#
+#   python benchmark_cv.py --batch-sizes 1 8 32 --threads 1 4 --output results/cv_benchmark.json
+#
+# The images come from data/sample_images plus synthetic frames at the requested resolutions
+# (written to a temporary folder as PNG, so decoding is measured as well). Every run goes through
+# the same stages as RoadScanner.scan_batch, timed separately:
+#   decode      - reading the files (create_nodes.load_images, shrunk to the model size)
+#   preprocess  - crop, resize and conversion to one tensor (RoadScanner._preprocess)
+#   forward     - the network itself (RoadScanner._forward; for .pt models this includes
+#                 building ultralytics' result objects)
+#   postprocess - turning the probabilities into reports (RoadScanner._to_report)
+# The backend follows the model file: --model best.onnx benchmarks onnxruntime.
+# The score cache is not used, so every image is scanned.
+
+import os
+
+# Hide any GPU before torch (or onnxruntime) is imported
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+import argparse
+import contextlib
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+from create_nodes import load_images
+from cv_inference import RoadScanner
+
+directory = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.path.join(directory, 'road_safety_project', 'hazard_classifier2', 'weights', 'best.pt')
+SAMPLE_IMAGES = os.path.join(directory, 'data', 'sample_images')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+
+def sample_paths():
+    return sorted(os.path.join(SAMPLE_IMAGES, name) for name in os.listdir(SAMPLE_IMAGES)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def synthetic_paths(folder, width, height, count, seed=0):
+    # Smooth random colour fields (compress and decode like photos, unlike pure noise)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        small = rng.integers(0, 256, size=(max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+        frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        path = os.path.join(folder, f'synthetic_{width}x{height}_{i}.png')
+        cv2.imwrite(path, frame)
+        paths.append(path)
+    return paths
+
+
+def run(scanner, paths, batch_size, decode_workers):
+    # Scans paths in chunks of batch_size and returns the seconds spent in every stage
+    stages = {'decode': 0.0, 'preprocess': 0.0, 'forward': 0.0, 'postprocess': 0.0}
+    scanned = 0
+    t_start = time.perf_counter()
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+
+        t0 = time.perf_counter()
+        frames = [frame for frame in load_images(chunk, scanner.imgsz, decode_workers) if frame is not None]
+        t1 = time.perf_counter()
+        if not frames:
+            stages['decode'] += t1 - t0
+            continue
+        batch = scanner._preprocess(frames)
+        t2 = time.perf_counter()
+        probabilities = scanner._forward(batch)
+        t3 = time.perf_counter()
+        for row in probabilities:
+            scanner._to_report(row)
+        t4 = time.perf_counter()
+
+        stages['decode'] += t1 - t0
+        stages['preprocess'] += t2 - t1
+        stages['forward'] += t3 - t2
+        stages['postprocess'] += t4 - t3
+        scanned += len(frames)
+
+    total = time.perf_counter() - t_start
+    return {
+        'images': scanned,
+        'total_s': total,
+        'images_per_s': scanned / total if total > 0 else None,
+        'stages_s': stages,
+        'per_image_ms': {name: seconds * 1000 / scanned if scanned else None
+                         for name, seconds in stages.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hazard classifier on the CPU")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=None,
+                        help="Intra-op thread counts to try (torch, or onnxruntime for .onnx models)")
+    parser.add_argument('--interop-threads', type=int, default=None,
+                        help="torch inter-op threads (can only be set once, before the first run)")
+    parser.add_argument('--resolutions', nargs='+', default=['640x480', '1920x1080'],
+                        help="Synthetic frame sizes, WIDTHxHEIGHT (none to skip)")
+    parser.add_argument('--synthetic-count', type=int, default=64, help="Synthetic frames per resolution")
+    parser.add_argument('--decode-workers', type=int, default=None,
+                        help="Threads decoding images (default: one per core)")
+    parser.add_argument('--output', help="Write the JSON here instead of printing it")
+    args = parser.parse_args()
+
+    rss_before_model = peak_rss_mb()
+    t0 = time.perf_counter()
+    # The constructor prints a loading message; keep stdout for the JSON alone
+    with contextlib.redirect_stdout(sys.stderr):
+        scanner = RoadScanner(args.model, cache=None, decode_workers=args.decode_workers)
+    load_s = time.perf_counter() - t0
+
+    if scanner.backend == 'onnx':
+        import onnxruntime
+        versions = {'onnxruntime': onnxruntime.__version__}
+    else:
+        import torch
+        if args.interop_threads:
+            torch.set_num_interop_threads(args.interop_threads)
+        versions = {'torch': torch.__version__, 'interop_threads': torch.get_num_interop_threads()}
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': scanner.backend,
+        **versions,
+        'model': os.path.relpath(args.model, directory),
+        'imgsz': scanner.imgsz,
+        'model_load_s': load_s,
+        'rss_before_model_mb': rss_before_model,
+        'rss_after_model_mb': peak_rss_mb(),
+        'runs': [],
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        sources = [('sample_images', None, sample_paths())]
+        for resolution in args.resolutions:
+            if resolution == 'none':
+                continue
+            width, height = (int(value) for value in resolution.lower().split('x'))
+            sources.append(('synthetic', resolution, synthetic_paths(folder, width, height, args.synthetic_count)))
+
+        for threads in args.threads or [os.cpu_count() or 1]:
+            scanner.set_threads(threads)
+            # Warm-up pass: the first forward pass allocates buffers and picks kernels
+            run(scanner, sources[0][2][:1], 1, args.decode_workers)
+
+            for source, resolution, paths in sources:
+                for batch_size in args.batch_sizes:
+                    print(f'  threads={threads} {source} {resolution or ""} batch={batch_size}', file=sys.stderr)
+                    result = run(scanner, paths, batch_size, args.decode_workers)
+                    result.update({'source': source, 'resolution': resolution,
+                                   'batch_size': batch_size, 'threads': threads,
+                                   # Highest RSS of the process so far (never goes down)
+                                   'peak_rss_mb': peak_rss_mb()})
+                    results['runs'].append(result)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# This file measures how fast the route searches are on road networks of any size.
+# It generates synthetic networks in the same format as image_metadata.json (DMS coordinate,
+# Connections, Distances, Directions per node), builds them into the CSR graph the searches use,
+# runs every engine over the same fixed set of queries and writes the results as JSON so they
+# can be compared between releases.
+#
+#   python benchmark_routing.py --sizes 100 1000 10000 --output results/routing_benchmark.json
+#
+# Two kinds of network are generated:
+#   grid      - a square city grid, some streets one-way
+#   geometric - random intersections, each joined to its nearest neighbours
+# Hazard scores are random (most roads safe, a few very hazardous) and turned into weights with
+# the same formula as create_graph.build_graph, so the searches see realistic weight spreads.
+#
+# Generation, build and preprocessing run under tracemalloc to get their peak memory, which also
+# makes them slower; query latencies are measured without it. Contraction hierarchies take
+# minutes from a few ten thousand nodes, see --max-preprocess-nodes.
+
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from a_star_search import A_star
+from contraction_hierarchy import CH_search, contraction_hierarchy
+from coordinate_conversion import dms_to_decimal
+from create_graph import PENALTY_FACTOR
+from create_nodes import parse_metadata
+from csr_graph import CSRBuilder
+from dijkstra_search import Dijkstra
+from geodesic import EARTH_RADIUS_M, haversine
+from landmarks import ALT_search, landmarks
+from search_trace import SearchTrace
+from spatial_index import SpatialIndex
+
+# Roughly where the real nodes are, and their typical spacing
+ORIGIN = (43.13, -79.11)
+SPACING_M = 150.0
+COMPASS = ['North', 'NorthEast', 'East', 'SouthEast', 'South', 'SouthWest', 'West', 'NorthWest']
+
+ENGINES = {
+    'astar': (A_star, None),
+    'dijkstra': (Dijkstra, None),
+    'alt': (ALT_search, landmarks),
+    'ch': (CH_search, lambda graph: contraction_hierarchy(graph, path=None)),
+}
+# Searches that can report nodes expanded through a SearchTrace
+TRACED_ENGINES = ('astar', 'dijkstra')
+
+
+def to_dms(latitude, longitude):
+    # Same format as image_metadata.json: 43°08'14"N 79°06'46"W (whole seconds)
+    def part(value, positive, negative):
+        hemisphere = positive if value >= 0 else negative
+        seconds = round(abs(value) * 3600)
+        return f"{seconds // 3600}°{seconds // 60 % 60:02d}'{seconds % 60:02d}\"{hemisphere}"
+    return f"{part(latitude, 'N', 'S')} {part(longitude, 'E', 'W')}"
+
+
+def offset(metres_north, metres_east):
+    # Coordinate this many metres away from ORIGIN
+    latitude = ORIGIN[0] + math.degrees(metres_north / EARTH_RADIUS_M)
+    longitude = ORIGIN[1] + math.degrees(metres_east / (EARTH_RADIUS_M * math.cos(math.radians(ORIGIN[0]))))
+    return latitude, longitude
+
+
+def compass(a, b):
+    # 8-point direction name from coordinate a to coordinate b
+    d_lat = b[0] - a[0]
+    d_lon = (b[1] - a[1]) * math.cos(math.radians(a[0]))
+    bearing = math.degrees(math.atan2(d_lon, d_lat)) % 360
+    return COMPASS[int((bearing + 22.5) // 45) % 8]
+
+
+def _network(coordinates, links, rng):
+    # Turns coordinates {node_id: (lat, lon)} and directed links [(a, b)] into metadata format.
+    # Coordinates are rounded to whole seconds first (like the real file) and distances are the
+    # straight line between the rounded points plus a random detour, in whole metres.
+    rounded = {node_id: dms_to_decimal(to_dms(*coord)) for node_id, coord in coordinates.items()}
+    data = {node_id: {'Coordinate': to_dms(*coordinates[node_id]), 'Connections': [],
+                      'Directions': [], 'Distances': []}
+            for node_id in coordinates}
+    for a, b in links:
+        distance = haversine(rounded[a], rounded[b]) * rng.uniform(1.0, 1.3)
+        data[a]['Connections'].append(b)
+        data[a]['Directions'].append(compass(rounded[a], rounded[b]))
+        data[a]['Distances'].append(max(1, round(distance)))
+    return data
+
+
+def grid_network(size, rng, one_way=0.1):
+    """
+    A square grid of about size intersections. Every street is two-way except for a random
+    one_way share, where one of the two directions is left out.
+    """
+    side = max(2, math.isqrt(size - 1) + 1)
+    coordinates = {}
+    for row in range(side):
+        for column in range(side):
+            coordinates[f'g{row}_{column}'] = offset(row * SPACING_M, column * SPACING_M)
+
+    links = []
+    for row in range(side):
+        for column in range(side):
+            here = f'g{row}_{column}'
+            for neighbor in (f'g{row + 1}_{column}', f'g{row}_{column + 1}'):
+                if neighbor not in coordinates:
+                    continue
+                if rng.random() < one_way:
+                    links.append((here, neighbor) if rng.random() < 0.5 else (neighbor, here))
+                else:
+                    links.append((here, neighbor))
+                    links.append((neighbor, here))
+    return _network(coordinates, links, rng)
+
+
+def geometric_network(size, rng, neighbours=3):
+    """
+    size random intersections at the same density as the grid, each joined both ways to its
+    nearest neighbours.
+    """
+    width = SPACING_M * math.sqrt(size)
+    coordinates = {f'r{i}': offset(rng.uniform(0, width), rng.uniform(0, width)) for i in range(size)}
+    node_ids = list(coordinates)
+    index = SpatialIndex([coordinates[n][0] for n in node_ids], [coordinates[n][1] for n in node_ids])
+
+    links = set()
+    for i, node_id in enumerate(node_ids):
+        for _, j in index.nearest(coordinates[node_id], k=neighbours + 1):
+            if j != i:
+                links.add((node_id, node_ids[j]))
+                links.add((node_ids[j], node_id))
+    return _network(coordinates, sorted(links), rng)
+
+
+GENERATORS = {'grid': grid_network, 'geometric': geometric_network}
+
+
+def build_csr(data, rng):
+    # Same steps as graph_snapshot.build_graph, with random hazard scores instead of the AI model
+    nodes = parse_metadata([], data)
+    for node in nodes.values():
+        node.coordinate = dms_to_decimal(node.coordinate)
+
+    builder = CSRBuilder(nodes)
+    for node in nodes.values():
+        node_hazard_score = rng.random() ** 4
+        for connection in node.connections:
+            builder.add_edge(connection['neighbor'], connection['distance'], connection['direction'],
+                             node_hazard_score,
+                             connection['distance'] * (1 + (node_hazard_score * PENALTY_FACTOR)))
+        builder.end_node()
+    return builder.finish()
+
+
+def graph_bytes(csr):
+    # Size of the edge and coordinate columns
+    return sum(column.itemsize * len(column) for column in
+               (csr.latitude, csr.longitude, csr.offsets, csr.targets, csr.distance,
+                csr.weight, csr.safety_score, csr.direction))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(function, *args):
+    # Returns (result, seconds, peak traced allocation in MB)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def benchmark_engine(csr, name, queries, reference, max_preprocess_nodes):
+    # Returns (report dict, cost of every query or None if the engine was skipped)
+    search, preprocess = ENGINES[name]
+    report = {}
+
+    if preprocess is not None:
+        if csr.node_count > max_preprocess_nodes:
+            return {'skipped': f'more than {max_preprocess_nodes} nodes (see --max-preprocess-nodes)'}, None
+        _, seconds, peak_mb = measure(preprocess, csr)
+        report['preprocess_s'] = seconds
+        report['preprocess_peak_mb'] = peak_mb
+
+    latencies = []
+    costs = []
+    for start, goal in queries:
+        t0 = time.perf_counter()
+        _, cost = search(csr, start, goal)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        costs.append(cost)
+
+    report.update({
+        'queries': len(queries),
+        'p50_ms': percentile(latencies, 0.50),
+        'p99_ms': percentile(latencies, 0.99),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'unreachable': sum(1 for cost in costs if cost == float('inf')),
+    })
+
+    if name in TRACED_ENGINES:
+        # Separate pass, so the timings above are measured without a trace
+        expanded = []
+        for start, goal in queries:
+            trace = SearchTrace()
+            search(csr, start, goal, trace=trace)
+            expanded.append(trace.nodes_popped - trace.stale_pops)
+        report['expanded_p50'] = percentile(expanded, 0.50)
+        report['expanded_mean'] = sum(expanded) / len(expanded) if expanded else None
+
+    if reference is not None:
+        # Costs that disagree with Dijkstra (should always be 0)
+        report['mismatches'] = sum(
+            1 for a, b in zip(costs, reference)
+            if not (a == b or abs(a - b) <= 1e-6 * max(1.0, abs(b)))
+        )
+    return report, costs
+
+
+def benchmark_network(kind, size, engines, query_count, seed, max_preprocess_nodes):
+    rng = random.Random(seed)
+    data, generate_s, _ = measure(GENERATORS[kind], size, rng)
+    csr, build_s, build_peak_mb = measure(build_csr, data, rng)
+    del data
+
+    query_rng = random.Random(seed + 1)
+    queries = [(query_rng.choice(csr.node_ids), query_rng.choice(csr.node_ids)) for _ in range(query_count)]
+
+    result = {
+        'kind': kind,
+        'nodes': csr.node_count,
+        'edges': csr.edge_count,
+        'generate_s': generate_s,
+        'build_s': build_s,
+        'build_peak_mb': build_peak_mb,
+        'graph_bytes': graph_bytes(csr),
+        'engines': {},
+    }
+
+    # Dijkstra runs first so the other engines can be checked against it
+    reference = None
+    for name in sorted(engines, key=lambda name: name != 'dijkstra'):
+        print(f'  {kind} {csr.node_count} nodes: {name}', file=sys.stderr)
+        report, costs = benchmark_engine(csr, name, queries, reference, max_preprocess_nodes)
+        if name == 'dijkstra':
+            reference = costs
+        result['engines'][name] = report
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the route searches on synthetic road networks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help="Approximate node counts (up to 1000000)")
+    parser.add_argument('--kinds', nargs='+', choices=sorted(GENERATORS), default=sorted(GENERATORS))
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument('--queries', type=int, default=200, help="Queries per network")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-preprocess-nodes', type=int, default=20_000,
+                        help="Skip engines that need preprocessing (ch, alt) on larger networks")
+    parser.add_argument('--output', help="Write the JSON here instead of printing it")
+    args = parser.parse_args()
+
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'queries': args.queries,
+        'seed': args.seed,
+        'networks': [],
+    }
+    for size in args.sizes:
+        for kind in args.kinds:
+            results['networks'].append(
+                benchmark_network(kind, size, args.engines, args.queries, args.seed, args.max_preprocess_nodes))
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['max_rss_mb'] = max_rss / (1e6 if sys.platform == 'darwin' else 1e3)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
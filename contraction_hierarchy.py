@@ -0,0 +1,394 @@
+# This file implements Contraction Hierarchies (CH), a preprocessing step that makes
+# point-to-point routes much cheaper than a full Dijkstra/A* search.
+#
+# Preprocessing ranks the nodes by "importance" and removes (contracts) them from least to most
+# important. Whenever removing a node would break a shortest path between two of its neighbours,
+# a shortcut edge is added between them. A query then runs two small Dijkstra searches, one
+# forward from the start and one backward from the goal, that only ever move to more important
+# nodes. The best meeting point gives the exact shortest path cost; shortcuts are unpacked
+# back into the original nodes for the path.
+#
+# The hierarchy is cached on disk next to the graph snapshot. The cache remembers the node
+# order, so when only the weights change (same nodes and edges) the order is reused and only
+# the shortcuts are recomputed, which is much faster than ordering from scratch.
+# Every named weighting profile (see weight_profiles.py) has its own hierarchy and cache file.
+
+import hashlib
+import heapq
+import os
+import pickle
+from array import array
+
+from csr_graph import as_csr
+from weight_profiles import DEFAULT_PROFILE, PROFILES, edge_weights, profile_name
+
+directory = os.path.dirname(__file__)
+DEFAULT_CH_PATH = os.path.join(directory, 'cache', 'graph.ch')
+CH_VERSION = 1
+
+# Witness searches give up after settling this many nodes (a missed witness only costs an
+# unnecessary shortcut, never a wrong answer)
+WITNESS_SETTLE_LIMIT = 500
+
+
+def topology_hash(csr):
+    # Fingerprint of the nodes and edges (not the weights)
+    h = hashlib.sha1(str(csr.node_count).encode())
+    h.update(array('I', csr.offsets).tobytes())
+    h.update(array('I', csr.targets).tobytes())
+    return h.hexdigest()
+
+
+def weights_hash(weights):
+    return hashlib.sha1(array('d', weights).tobytes()).hexdigest()
+
+
+class ContractionHierarchy:
+    """
+    The result of contracting a graph.
+
+    Attributes:
+        rank (list): Contraction position of every node index (higher = more important).
+        up_offsets, up_targets, up_weights, up_middles: CSR of the edges u -> w with
+            rank[w] > rank[u], stored at u (used by the forward search).
+        down_offsets, down_sources, down_weights, down_middles: CSR of the edges u -> v with
+            rank[u] > rank[v], stored at v (used by the backward search).
+        A middle of -1 marks an original edge; otherwise the edge is a shortcut through that node.
+    """
+
+    def __init__(self, rank, up, down, topology='', weights=''):
+        self.rank = rank
+        self.up_offsets, self.up_targets, self.up_weights, self.up_middles = up
+        self.down_offsets, self.down_sources, self.down_weights, self.down_middles = down
+        self.topology_hash = topology
+        self.weights_hash = weights
+
+    @property
+    def node_count(self):
+        return len(self.rank)
+
+    @property
+    def shortcut_count(self):
+        return (sum(1 for m in self.up_middles if m != -1)
+                + sum(1 for m in self.down_middles if m != -1))
+
+    @property
+    def order(self):
+        # Node indexes from least to most important
+        order = [0] * len(self.rank)
+        for node, position in enumerate(self.rank):
+            order[position] = node
+        return order
+
+    def query(self, start, goal):
+        """
+        Exact shortest path between two node indexes.
+        Returns (list of node indexes, cost); ([goal], inf) if the goal is unreachable.
+        """
+        if start == goal:
+            return [start], 0.0
+
+        # Each direction: best cost, parent (node, edge) and heap
+        searches = (
+            ({start: 0.0}, {start: None}, [(0.0, start)],
+             self.up_offsets, self.up_targets, self.up_weights),
+            ({goal: 0.0}, {goal: None}, [(0.0, goal)],
+             self.down_offsets, self.down_sources, self.down_weights),
+        )
+        best = float('inf')
+        meeting = -1
+
+        while True:
+            forward_heap, backward_heap = searches[0][2], searches[1][2]
+            # A direction is finished once nothing left in it can beat the best meeting found
+            forward_open = bool(forward_heap) and forward_heap[0][0] < best
+            backward_open = bool(backward_heap) and backward_heap[0][0] < best
+            if not forward_open and not backward_open:
+                break
+
+            if forward_open and (not backward_open or forward_heap[0][0] <= backward_heap[0][0]):
+                side = 0
+            else:
+                side = 1
+            costs, parents, heap, offsets, neighbors, weights = searches[side]
+            other_costs = searches[1 - side][0]
+
+            cost, node = heapq.heappop(heap)
+            if cost > costs[node]:
+                continue
+
+            if node in other_costs and cost + other_costs[node] < best:
+                best = cost + other_costs[node]
+                meeting = node
+
+            for e in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[e]
+                new_cost = cost + weights[e]
+                if new_cost < costs.get(neighbor, float('inf')):
+                    costs[neighbor] = new_cost
+                    parents[neighbor] = (node, e)
+                    heapq.heappush(heap, (new_cost, neighbor))
+
+        if meeting == -1:
+            return [goal], float('inf')
+
+        # Walk back to the start and forward to the goal, unpacking every shortcut on the way
+        forward_parents, backward_parents = searches[0][1], searches[1][1]
+        path = [meeting]
+        node = meeting
+        while forward_parents[node] is not None:
+            parent, e = forward_parents[node]
+            segment = self._unpack(parent, node, self.up_middles[e])
+            path[:0] = segment[:-1]
+            node = parent
+
+        node = meeting
+        while backward_parents[node] is not None:
+            child, e = backward_parents[node]
+            segment = self._unpack(node, child, self.down_middles[e])
+            path.extend(segment[1:])
+            node = child
+
+        return path, best
+
+    def _unpack(self, u, w, middle):
+        # Expands the edge u -> w into the original nodes it stands for (u ... w)
+        if middle == -1:
+            return [u, w]
+        # The middle node was contracted before u and w, so u -> middle is stored at the middle
+        # as a downward edge and middle -> w as an upward edge
+        left = self._edge_middle(self.down_offsets, self.down_sources, self.down_middles,
+                                 self.down_weights, middle, u)
+        right = self._edge_middle(self.up_offsets, self.up_targets, self.up_middles,
+                                  self.up_weights, middle, w)
+        return self._unpack(u, middle, left)[:-1] + self._unpack(middle, w, right)
+
+    @staticmethod
+    def _edge_middle(offsets, neighbors, middles, weights, node, neighbor):
+        found = None
+        for e in range(offsets[node], offsets[node + 1]):
+            if neighbors[e] == neighbor and (found is None or weights[e] < weights[found]):
+                found = e
+        return middles[found]
+
+
+def build_contraction_hierarchy(graph, weights=None, order=None, witness_settle_limit=WITNESS_SETTLE_LIMIT):
+    """
+    Contracts every node of a graph.
+
+    Args:
+        graph: The built graph (create_graph or CSRGraph).
+        weights: Edge costs (defaults to the graph's 'weight' column).
+        order (list): Node indexes from least to most important. When given (e.g. the order of
+                      an older hierarchy for the same roads) the nodes are contracted in that
+                      order instead of choosing one, which is much faster.
+        witness_settle_limit (int): See WITNESS_SETTLE_LIMIT.
+
+    Returns:
+        ContractionHierarchy
+    """
+    csr = as_csr(graph)
+    weights = csr.weight if weights is None else weights
+    n = csr.node_count
+
+    # Remaining graph: out_edges[u][w] = (cost, middle), in_edges[w][u] = the same edge
+    out_edges = [{} for _ in range(n)]
+    in_edges = [{} for _ in range(n)]
+    for u in range(n):
+        for e in range(csr.offsets[u], csr.offsets[u + 1]):
+            w = csr.targets[e]
+            cost = weights[e]
+            if w != u and cost < out_edges[u].get(w, (float('inf'),))[0]:
+                out_edges[u][w] = (cost, -1)
+                in_edges[w][u] = (cost, -1)
+
+    contracted = [False] * n
+    deleted_neighbors = [0] * n
+
+    def witness_costs(source, skip, limit):
+        # Dijkstra in the remaining graph from source, not passing through skip
+        costs = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > costs[node]:
+                continue
+            if cost > limit or settled >= witness_settle_limit:
+                break
+            settled += 1
+            for neighbor, (edge_cost, _) in out_edges[node].items():
+                if neighbor == skip:
+                    continue
+                new_cost = cost + edge_cost
+                if new_cost < costs.get(neighbor, float('inf')):
+                    costs[neighbor] = new_cost
+                    heapq.heappush(heap, (new_cost, neighbor))
+        return costs
+
+    def needed_shortcuts(v):
+        shortcuts = []
+        outgoing = list(out_edges[v].items())
+        for u, (in_cost, _) in in_edges[v].items():
+            limit = max((in_cost + out_cost for w, (out_cost, _) in outgoing if w != u), default=None)
+            if limit is None:
+                continue
+            costs = witness_costs(u, v, limit)
+            for w, (out_cost, _) in outgoing:
+                if w != u and costs.get(w, float('inf')) > in_cost + out_cost:
+                    shortcuts.append((u, w, in_cost + out_cost))
+        return shortcuts
+
+    def priority(v):
+        # Edge difference (shortcuts added minus edges removed), plus a term that spreads
+        # contraction evenly over the graph
+        removed = len(out_edges[v]) + len(in_edges[v])
+        return len(needed_shortcuts(v)) - removed + deleted_neighbors[v]
+
+    up = [[] for _ in range(n)]
+    down = [[] for _ in range(n)]
+    rank = [0] * n
+
+    def contract(v, position):
+        for u, w, cost in needed_shortcuts(v):
+            if cost < out_edges[u].get(w, (float('inf'),))[0]:
+                out_edges[u][w] = (cost, v)
+                in_edges[w][u] = (cost, v)
+
+        # Every edge still attached to v leads to a node contracted later (more important)
+        up[v] = [(w, cost, middle) for w, (cost, middle) in out_edges[v].items()]
+        down[v] = [(u, cost, middle) for u, (cost, middle) in in_edges[v].items()]
+        for w in out_edges[v]:
+            del in_edges[w][v]
+            deleted_neighbors[w] += 1
+        for u in in_edges[v]:
+            del out_edges[u][v]
+            deleted_neighbors[u] += 1
+        out_edges[v] = {}
+        in_edges[v] = {}
+        contracted[v] = True
+        rank[v] = position
+
+    if order is not None:
+        for position, v in enumerate(order):
+            contract(v, position)
+    else:
+        # Lazy updates: a node's priority is recomputed when it reaches the top of the queue,
+        # and it is only contracted if it is still the least important node
+        queue = [(priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        position = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            current = priority(v)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+            contract(v, position)
+            position += 1
+
+    def to_csr(edges):
+        offsets = array('I', [0])
+        neighbors = array('I')
+        costs = array('d')
+        middles = array('i')
+        for node_edges in edges:
+            for neighbor, cost, middle in node_edges:
+                neighbors.append(neighbor)
+                costs.append(cost)
+                middles.append(middle)
+            offsets.append(len(neighbors))
+        return offsets, neighbors, costs, middles
+
+    return ContractionHierarchy(rank, to_csr(up), to_csr(down), topology_hash(csr), weights_hash(weights))
+
+
+def save_contraction_hierarchy(ch, path=DEFAULT_CH_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump({
+            'version': CH_VERSION,
+            'topology_hash': ch.topology_hash,
+            'weights_hash': ch.weights_hash,
+            'rank': array('I', ch.rank),
+            'up': (ch.up_offsets, ch.up_targets, ch.up_weights, ch.up_middles),
+            'down': (ch.down_offsets, ch.down_sources, ch.down_weights, ch.down_middles),
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_contraction_hierarchy(path=DEFAULT_CH_PATH):
+    # Returns the cached hierarchy, or None if there is no usable cache file
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Ignoring contraction hierarchy cache {path} ({e})")
+        return None
+    if data.get('version') != CH_VERSION:
+        return None
+    return ContractionHierarchy(list(data['rank']), data['up'], data['down'],
+                                data['topology_hash'], data['weights_hash'])
+
+
+def profile_path(path, name):
+    # Cache file of a profile: graph.ch for the default one, graph.<profile>.ch for the others
+    if name == DEFAULT_PROFILE:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
+
+
+def contraction_hierarchy(graph, path=DEFAULT_CH_PATH, profile=None):
+    """
+    Returns the hierarchy for the graph's current weights under a named profile (None = the
+    default): from memory, from the cache file, or freshly built (reusing the cached node
+    order when only the weights changed). path=None skips the cache file.
+    """
+    csr = as_csr(graph)
+    name = profile_name(profile)
+    if name not in PROFILES:
+        raise ValueError(f"Contraction hierarchies are only kept for the profiles {', '.join(PROFILES)}")
+    ch = csr.derived.get(('ch', name))
+    if ch is not None:
+        return ch
+
+    weights = edge_weights(csr, name)
+    path = profile_path(path, name) if path else None
+    topology = topology_hash(csr)
+    current_weights = weights_hash(weights)
+    cached = load_contraction_hierarchy(path) if path else None
+
+    if cached is not None and cached.topology_hash == topology and cached.weights_hash == current_weights:
+        ch = cached
+    else:
+        order = cached.order if cached is not None and cached.topology_hash == topology else None
+        ch = build_contraction_hierarchy(csr, weights=weights, order=order)
+        if path:
+            try:
+                save_contraction_hierarchy(ch, path)
+            except OSError as e:
+                print(f"Warning: Could not write contraction hierarchy cache. ({e})")
+
+    # The shortest profile's hierarchy only reads distances, so it survives safety score updates
+    ch.distance_only = PROFILES[name] == 0
+    csr.derived[('ch', name)] = ch
+    return ch
+
+
+def CH_search(graph, start, goal, profile=None):
+    # Point-to-point route using the graph's contraction hierarchy for a named profile
+    # Returns (path_list, total_cost), or ([goal], float('inf')) if the goal is unreachable
+    csr = as_csr(graph)
+    if start not in csr.index or goal not in csr.index:
+        return [goal], float('inf')
+
+    path, cost = contraction_hierarchy(csr, profile=profile).query(csr.index[start], csr.index[goal])
+    if cost == float('inf'):
+        return [goal], cost
+    return csr.path_ids(path), cost
@@ -1,74 +1,164 @@
 # This file is used to turn nodes into a graphical format
 # Updated to include Computer Vision integration for safety scoring
-# Try to import the RoadScanner from our inference file
+# The RoadScanner (and with it OpenCV / the model runtime) is only imported when a graph is
+# created with the AI enabled, so routing-only processes never load them
 
-try:
-    from cv_inference import RoadScanner
-except ImportError:
-    RoadScanner = None
+from create_nodes import LazyImage
+from csr_graph import CSRBuilder
+from hazard_profile import build_hazard_profiles, dated_hazards
+from score_cache import HazardScoreCache, DEFAULT_CACHE_PATH, model_digest, image_digest
+
+# How much longer a fully hazardous road looks to the searches (see build_graph)
+PENALTY_FACTOR = 5.0
 
 class create_graph:
 
     # INITIALIZE EMPTY GRAPH
-    def __init__(self, model_path='road_safety_project/hazard_classifier2/weights/best.pt'):
+    def __init__(self, model_path='road_safety_project/hazard_classifier2/weights/best.pt',
+                 cache_path=DEFAULT_CACHE_PATH, routing_only=False):
+        """
+        Args:
+            model_path (str): The trained classifier (.pt or .onnx).
+            cache_path (str): The hazard score cache (see score_cache.py), None to turn it off.
+            routing_only (bool): Don't load the model; take every score from the cache instead
+                                 (images without a cached score count as safe).
+        """
         self.nodes = {}
         self.adjacency = {}
-        
-        # Initialize the AI Model if available
+        self.csr = None
         self.scanner = None
-        if RoadScanner:
+        # Hash of the weights the safety scores came from ('' if the scores are incomplete)
+        self.weights_hash = ''
+
+        # Scores are kept on disk between runs so unchanged images are never rescanned
+        # (cache_path=None turns this off)
+        self.score_cache = None
+        if cache_path:
             try:
-                # Initialize the model with the path to our trained weights
-                self.scanner = RoadScanner(model_path)
-                print("AI Road Scanner loaded successfully.")
+                self.score_cache = HazardScoreCache(cache_path)
             except Exception as e:
-                print(f"Warning: Could not load AI model. Graph will use default weights. ({e})")
-        else:
+                print(f"Warning: Could not open hazard score cache. Every image will be scanned. ({e})")
+
+        if routing_only:
+            # Only the weights file is read (to match cached scores), nothing is imported
+            try:
+                self.weights_hash = model_digest(model_path)
+            except OSError as e:
+                print(f"Warning: Could not read model weights. Graph will use default weights. ({e})")
+            if self.score_cache is None:
+                self.weights_hash = ''
+            return
+
+        # Try to import the RoadScanner from our inference file
+        try:
+            from cv_inference import RoadScanner
+        except ImportError:
             print("Warning: cv_inference.py not found. AI safety features are disabled.")
+            return
+
+        # Initialize the AI Model if available
+        try:
+            # Initialize the model with the path to our trained weights
+            self.scanner = RoadScanner(model_path, cache=self.score_cache)
+            self.weights_hash = self.scanner.weights_hash
+            print("AI Road Scanner loaded successfully.")
+        except Exception as e:
+            print(f"Warning: Could not load AI model. Graph will use default weights. ({e})")
 
     def get_node_safety_score(self, node):
         """
         Analyzes all images attached to a node to calculate a safety score.
         Returns a float between 0.0 (Safe) and 1.0 (Hazardous).
         """
-        # If AI is disabled or node has no images, assume it's safe (0.0)
-        if not self.scanner or not node.images:
-            return 0.0
-
-        scores = []
-        for img_data in node.images:
-            # We use the raw image (numpy array) stored in 'picture' by create_nodes.py
-            image = img_data.get('picture')
-            
-            # Only scan if the image was loaded successfully
-            if image is not None:
-                # Scan the image using the loaded AI model
-                # Note: Ensure our cv_inference.py accepts numpy arrays (cv2 images)
-                result = self.scanner.scan_image(image)
-                scores.append(result['hazard_score'])
-        
-        # Strategy: Return the average hazard score of all images at this location
-        if scores:
-            return sum(scores) / len(scores)
-        
-        return 0.0
+        return self.score_nodes({node.id: node}).get(node.id, 0.0)
+
+    def score_nodes(self, nodes):
+        """
+        Calculates the safety score of every node with a single batched scan.
+        Returns a dict of node_id -> float between 0.0 (Safe) and 1.0 (Hazardous).
+        """
+        return self.average_scores(self.score_images(nodes))
+
+    def score_images(self, nodes):
+        """
+        Scans every image of the given nodes in one batched pass.
+        All pictures are collected up front so the model runs over fixed-size
+        batches instead of once per image.
+        Returns a dict of node_id -> one AI report per entry of node.images
+        (None where the image could not be scored).
+        """
+        # If AI is disabled, no image gets a score
+        if not self.scanner and not self.weights_hash:
+            return {node_id: [None] * len(node.images) for node_id, node in nodes.items()}
+
+        # We use the images (lazy handles or numpy arrays) stored in 'picture' by create_nodes.py
+        pictures = []
+        owners = []
+        for node_id, node in nodes.items():
+            for position, img_data in enumerate(node.images):
+                image = img_data.get('picture')
+
+                # Only scan if the image was loaded successfully
+                if image is not None:
+                    pictures.append(image)
+                    owners.append((node_id, position))
+
+        if self.scanner:
+            reports = self.scanner.scan_batch(pictures)
+        else:
+            reports = self.cached_reports(pictures)
+
+        node_reports = {node_id: [None] * len(node.images) for node_id, node in nodes.items()}
+        for (node_id, position), result in zip(owners, reports):
+            node_reports[node_id][position] = result
+        return node_reports
+
+    @staticmethod
+    def average_scores(node_reports):
+        # Strategy: The score of a location is the average hazard score of all its images
+        # (0.0 = safe when none of them could be scored)
+        scores = {}
+        for node_id, reports in node_reports.items():
+            values = [result['hazard_score'] for result in reports if result is not None]
+            scores[node_id] = sum(values) / len(values) if values else 0.0
+        return scores
+
+    def cached_reports(self, pictures):
+        """
+        Routing-only scoring: looks every picture up in the score cache without decoding it
+        or loading the model. Returns one report per picture, None where nothing is cached.
+        """
+        keys = [image_digest(picture) for picture in pictures]
+        found = self.score_cache.get_many(set(keys), self.weights_hash)
+        missing = sum(1 for key in keys if key not in found)
+        if missing:
+            print(f"Warning: {missing} images have no cached score for this model and count as safe. "
+                  "Build once with the AI model to score them.")
+            # The graph doesn't match the model any more, so it must not be saved as if it did
+            self.weights_hash = ''
+        return [found.get(key) for key in keys]
 
     def build_graph(self, all_nodes):
         # STORE ALL NODES IN THE GRAPH
         self.nodes = all_nodes
 
+        # Calculate the safety score for every location (Node) using Computer Vision
+        # 0.0 = Safe, 1.0 = Highly Hazardous
+        node_reports = self.score_images(self.nodes)
+        hazard_scores = self.average_scores(node_reports)
+
         # CHECK CONNECTIONS
+        # Edges go straight into the compact CSR arrays (see csr_graph.py) that the searches use
+        builder = CSRBuilder(self.nodes)
         for node_id, node in self.nodes.items():
-            self.adjacency[node_id] = {}
-
-            # Calculate the safety score for this location (Node) using Computer Vision
-            # 0.0 = Safe, 1.0 = Highly Hazardous
-            node_hazard_score = self.get_node_safety_score(node)
+            node_hazard_score = hazard_scores[node_id]
+            added = set()
 
             for connection in node.connections:
                 neighbor_id = connection['neighbor']
 
-                if neighbor_id in self.nodes:
+                if neighbor_id in self.nodes and neighbor_id not in added:
+                    added.add(neighbor_id)
                     base_distance = connection['distance']
                     
                     # AI SAFETY INTEGRATION
@@ -77,13 +167,103 @@ class create_graph:
                     # Example: If hazard is 1.0 (100%), and penalty is 5.0, 
                     # the road will "look" 6 times longer to the pathfinding algorithm.
 
-                    penalty_factor = 5.0 
+                    penalty_factor = PENALTY_FACTOR
                     adjusted_weight = base_distance * (1 + (node_hazard_score * penalty_factor))
 
-                    self.adjacency[node_id][neighbor_id] = {
-                        'distance': base_distance,
-                        'direction': connection['direction'],
-                        'safety_score': node_hazard_score,   # Store score for UI display
-                        'weight': adjusted_weight            # Use this for Dijkstra/A*
-                    }
-        return self
\ No newline at end of file
+                    builder.add_edge(
+                        neighbor_id,
+                        base_distance,
+                        connection['direction'],
+                        node_hazard_score,   # Store score for UI display
+                        adjusted_weight      # Use this for Dijkstra/A*
+                    )
+            builder.end_node()
+
+        self.csr = builder.finish(self.nodes)
+        # Read-only dict-of-dicts view of the edges: adjacency[node_id][neighbor_id] -> edge dict
+        self.adjacency = self.csr.adjacency
+
+        # Per-year scores from the same reports plus the recorded severities, so routes can be
+        # planned as of any year without scanning again (see hazard_profile.py)
+        self.csr.hazard_profiles = build_hazard_profiles(
+            self.csr.node_ids, {node_id: node.images for node_id, node in self.nodes.items()}, node_reports)
+
+        # Build the nearest-node index now so the first map click doesn't pay for it
+        self.csr.spatial_index
+        return self
+
+    @classmethod
+    def from_csr(cls, csr, nodes, model_path='road_safety_project/hazard_classifier2/weights/best.pt',
+                 cache_path=DEFAULT_CACHE_PATH):
+        """
+        Wraps an already built graph (e.g. a loaded snapshot) so update_node_images can
+        rescan its nodes. nodes must hold the images of every node (see parse_metadata).
+        """
+        graph = cls(model_path, cache_path)
+        graph.nodes = nodes
+        graph.csr = csr
+        graph.adjacency = csr.adjacency
+        return graph
+
+    def update_node_images(self, node_id, new_images, replace=False):
+        """
+        Adds new images to a node, rescans only that node and patches the safety score and
+        weight of its outgoing edges (and the node's hazard profile) in place, without
+        rebuilding the graph.
+
+        Args:
+            node_id (str): The node the images were taken at.
+            new_images (list): Image dicts as made by parse_metadata ('picture', 'year', ...),
+                               or bare pictures (path, numpy array or LazyImage).
+            replace (bool): Drop the node's old images instead of adding to them.
+
+        Returns:
+            float: The node's new hazard score.
+
+        Raises:
+            RuntimeError: The AI model is not loaded, so the new images can't be scored.
+        """
+        # Without a scanner every score would come back empty and the edges would be reset to 0.0
+        if self.scanner is None:
+            raise RuntimeError("The AI model is not loaded, images can't be scored")
+
+        node = self.nodes[node_id]
+        entries = [dict(image) if isinstance(image, dict) else {'picture': image} for image in new_images]
+        # The scanner and the score cache identify pictures by content, so paths become lazy handles
+        for entry in entries:
+            if isinstance(entry.get('picture'), str):
+                entry['picture'] = LazyImage(entry['picture'])
+        node.images = entries if replace else node.images + entries
+
+        # Images scanned before come straight from the score cache
+        reports = self.score_images({node_id: node})
+        node_hazard_score = self.average_scores(reports)[node_id]
+
+        csr = self.csr
+        i = csr.index[node_id]
+        first, last = csr.offsets[i], csr.offsets[i + 1]
+        if csr.hazard_profiles is not None:
+            csr.hazard_profiles.update_node(i, dated_hazards(node.images, reports[node_id]))
+
+        # The score is stored on the outgoing edges, nodes without any have nothing to patch.
+        # With hazard profiles the weights computed from them are stale even if the average is not
+        if first == last or (csr.safety_score[first] == node_hazard_score and csr.hazard_profiles is None):
+            return node_hazard_score
+
+        increased = node_hazard_score >= csr.safety_score[first]
+        for e in range(first, last):
+            csr.safety_score[e] = node_hazard_score
+            csr.weight[e] = csr.distance[e] * (1 + (node_hazard_score * PENALTY_FACTOR))
+
+        # Drops the contraction hierarchies and the profile weights that read the safety scores
+        # (and their landmarks if a weight went down) and bumps csr.version so route caches know
+        # their entries are stale
+        csr.weights_changed(increased)
+        return node_hazard_score
+
+    def nearest(self, coord, k=1, max_radius_m=None):
+        """
+        Returns up to k (node_id, distance in metres) pairs for the nodes closest to
+        coord = (latitude, longitude), closest first. See CSRGraph.nearest.
+        """
+        return self.csr.nearest(coord, k, max_radius_m)
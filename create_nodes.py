@@ -3,12 +3,21 @@
 # These nodes can later be turned into graphs for future use.
 # The source of information within this project is contained in the image_metadata.json file.
 
+# cv2 is imported inside the functions that decode images, so a process that only routes
+# over the nodes never loads OpenCV
 import json
-import cv2
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 directory = os.path.dirname(__file__)
 
+# How many bytes of decoded pixels may stay in memory at once (see ImageCache)
+DEFAULT_IMAGE_CACHE_BYTES = 32 * 1024 * 1024
+
 class create_nodes:
     def __init__(self, node_id, coordinate):
         self.id = node_id
@@ -26,41 +35,180 @@ class create_nodes:
     def add_image(self, image_data):
         self.images.append(image_data)
 
-# Makes an array of all the images in order of the json node data.
-def open_images():
-    images = []
+# Keeps recently decoded images in memory, dropping the least recently used ones
+# once the total size of the stored pixels goes over max_bytes.
+class ImageCache:
+    def __init__(self, max_bytes=DEFAULT_IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        # Images bigger than the whole budget are never stored
+        if image is None or image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self._entries[key] = image
+            self.current_bytes += image.nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, image = self._entries.popitem(last=False)
+            self.current_bytes -= image.nbytes
+
+# Shared by every LazyImage unless one is given its own cache
+image_cache = ImageCache()
+
+# A handle to an image file that is only decoded when its pixels are needed.
+# Nodes keep these instead of full resolution arrays, so a running process only holds
+# the file paths plus whatever fits in the shared ImageCache.
+class LazyImage:
+    __slots__ = ('path', 'target_size', 'cache', '_digest')
+
+    def __init__(self, path, target_size=None, cache=None):
+        self.path = path
+        self.target_size = target_size   # decode straight to this short side (pixels), None = full size
+        self.cache = cache if cache is not None else image_cache
+        self._digest = None
+
+    # SHA-1 of the file bytes. Identifies the image without decoding it.
+    @property
+    def digest(self):
+        if self._digest is None:
+            h = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            self._digest = h.hexdigest()
+        return self._digest
+
+    # Returns the decoded BGR numpy array (or None if the file can't be read)
+    def load(self, target_size=None):
+        target_size = target_size or self.target_size
+        key = (self.path, target_size)
+        image = self.cache.get(key)
+        if image is None:
+            image = decode_image(self.path, target_size)
+            self.cache.put(key, image)
+        return image
 
-    def load_img(*parts):
-        path = os.path.join(directory, *parts)
-        return cv2.imread(path) if os.path.isfile(path) else None
+    def __repr__(self):
+        return f"LazyImage({self.path!r})"
 
-    for i in range(1, 25):
-        for j in range(1, 7):
-            img = load_img('images', 'h_pics', f'h{i}_{j}.png')
-            images.append(img)
+# Resizes image so its short side equals size exactly the way the classifier's own transforms
+# do (ultralytics classify_transforms: torchvision Resize on a PIL image, bilinear with
+# antialiasing), so frames shrunk here score the same as the original file.
+def resize_short_side(image, size):
+    import numpy as np
+    from PIL import Image
 
-    for i in range(1, 25):
-        for j in range(1, 7):
-            img = load_img('images', 'l_pics', f'l{i}_{j}.png')
-            images.append(img)
+    height, width = image.shape[:2]
+    if min(height, width) == size:
+        return image
+    # Same rounding as torchvision: the long side is truncated
+    if width <= height:
+        new_size = (size, int(size * height / width))
+    else:
+        new_size = (int(size * width / height), size)
+    return np.asarray(Image.fromarray(image).resize(new_size, Image.BILINEAR))
 
-    for i in range(1, 22):
-        for j in range(1, 7):
-            img = load_img('images', 'c_pics', f'c{i}_{j}.png')
-            images.append(img)
+# Decodes one image file. When target_size is given, images with a larger short side are
+# shrunk to it right away (see resize_short_side), so only the small copy is kept.
+def decode_image(path, target_size=None):
+    import cv2
+
+    image = cv2.imread(path)
+    if image is None or not target_size:
+        return image
+    if min(image.shape[:2]) > target_size:
+        image = resize_short_side(image, target_size)
+    return image
+
+# Returns the paths of all the images in order of the json node data.
+def image_paths():
+    paths = []
+    groups = [('h', 24), ('l', 24), ('c', 21), ('s', 25)]
+
+    for prefix, count in groups:
+        for i in range(1, count + 1):
+            for j in range(1, 7):
+                paths.append(os.path.join(directory, 'images', f'{prefix}_pics', f'{prefix}{i}_{j}.png'))
+
+    return paths
+
+# Decodes many images at once on a pool of threads. cv2.imread releases the GIL, so this
+# scales with the number of cores. Accepts file paths, LazyImage handles, numpy arrays
+# (passed through) or None, and returns the decoded arrays in the same order
+# (None where nothing could be decoded).
+def load_images(images, target_size=None, workers=None, report=False):
+    workers = workers or os.cpu_count() or 1
+
+    def load(image):
+        if image is None:
+            return None
+        if isinstance(image, str):
+            return decode_image(image, target_size)
+        if isinstance(image, LazyImage):
+            return image.load(target_size)
+        return image
+
+    start = time.perf_counter()
+    if workers == 1 or len(images) <= 1:
+        decoded = [load(image) for image in images]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() hands the results back in input order, whatever order they finish in
+            decoded = list(pool.map(load, images))
+    elapsed = time.perf_counter() - start
+
+    if report:
+        count = sum(image is not None for image in decoded)
+        rate = count / elapsed if elapsed > 0 else float('inf')
+        print(f"Decoded {count} images in {elapsed:.2f}s ({rate:.1f} images/s on {workers} threads)")
+
+    return decoded
+
+# Makes an array of all the images in order of the json node data.
+# By default the array holds LazyImage handles (None for missing files) so nothing is decoded
+# until an image is used. lazy=False decodes every image up front into numpy arrays,
+# spread over `workers` threads (defaults to one per core).
+def open_images(lazy=True, target_size=None, workers=None):
+    paths = [path if os.path.isfile(path) else None for path in image_paths()]
 
-    for i in range(1, 26):
-        for j in range(1, 7):
-            img = load_img('images', 's_pics', f's{i}_{j}.png')
-            images.append(img)
+    if lazy:
+        return [LazyImage(path, target_size) if path else None for path in paths]
 
-    return images
+    return load_images(paths, target_size, workers, report=True)
 
-def parse_metadata(images):
+def parse_metadata(images, data=None):
     # OPEN file relative to module directory
-    json_path = os.path.join(directory, 'image_metadata.json')
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # (data can be given instead, a dict in the same format, e.g. a generated test network)
+    if data is None:
+        json_path = os.path.join(directory, 'image_metadata.json')
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
 
     #LIST OF NODES
     nodes = {}
@@ -104,6 +252,7 @@ def parse_metadata(images):
 
 # Test to show that images are properly stored in each node. Can be deleted when no longer needed.
 if __name__ == "__main__":
+    import cv2
 
     images = open_images()
     nodes = parse_metadata(images)
@@ -111,6 +260,8 @@ if __name__ == "__main__":
     for node_id, node in nodes.items():
         for img_data in node.images:
             img = img_data['picture']
+            if isinstance(img, LazyImage):
+                img = img.load()
             window_name = f"Node {node_id} - Image {img_data['image']}"
             if img is None:
                 print(f"Skipped missing image: {window_name}")
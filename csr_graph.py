@@ -0,0 +1,312 @@
+# This file holds the compact graph representation used by the search algorithms.
+# Nodes are numbered 0..n-1 and the edges are stored in CSR (compressed sparse row) form:
+# the outgoing edges of node i are the positions offsets[i] to offsets[i+1] of the edge columns
+# (targets, distance, weight, safety_score, direction).
+# Every column is a flat typed array (array module or a memoryview of a snapshot file), so a
+# graph costs a few bytes per edge instead of a dict per edge, and an edge relaxation is
+# plain integer indexing instead of string-keyed lookups.
+#
+# nodes and adjacency are kept as read-only views with the same shape as the old
+# create_graph dicts, so existing code that looks up graph.adjacency[node_id] still works.
+
+import math
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+from create_nodes import create_nodes
+from geodesic import admissible_scale
+from spatial_index import SpatialIndex
+
+NO_DIRECTION = 255
+
+
+class CSRGraph:
+    """
+    Array-backed road graph.
+
+    Attributes:
+        node_ids (list): Node id (str) of every node index.
+        index (dict): node id -> node index.
+        latitude, longitude: Decimal coordinates per node (NaN when unknown).
+        offsets: n + 1 edge offsets; edges of node i are offsets[i]:offsets[i+1].
+        targets: Node index each edge leads to.
+        distance, weight, safety_score: float64 edge columns.
+        direction: Direction code per edge (index into directions, NO_DIRECTION = none).
+        directions (list): Direction names.
+        hazard_profiles: Per-year hazard score of every node (see hazard_profile.py), or None.
+    """
+
+    def __init__(self, node_ids, latitude, longitude, offsets, targets,
+                 distance, weight, safety_score, direction, directions, nodes=None):
+        self.node_ids = node_ids
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.latitude = latitude
+        self.longitude = longitude
+        self.offsets = offsets
+        self.targets = targets
+        self.distance = distance
+        self.weight = weight
+        self.safety_score = safety_score
+        self.direction = direction
+        self.directions = directions
+
+        # Builders that already have node objects (with images) pass them in;
+        # otherwise light node objects are made on demand
+        self.nodes = nodes if nodes is not None else _NodesView(self)
+        self.adjacency = _AdjacencyView(self)
+        self._spatial_index = None
+        self._heuristic_scale = None
+        self._distance_scale = None
+        self._reverse = None
+        self._edge_sources = None
+        self.hazard_profiles = None
+        # Structures computed from the edge weights (e.g. the contraction hierarchy), by name
+        self.derived = {}
+        # Goes up by one every time edge weights are patched, so caches can tell they are stale
+        self.version = 0
+
+    @property
+    def node_count(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    @classmethod
+    def from_adjacency(cls, nodes, adjacency):
+        """
+        Builds the arrays from create_nodes objects and a dict-of-dicts adjacency
+        (node_id -> {neighbor_id: {'distance', 'direction', 'safety_score', 'weight'}}).
+        """
+        builder = CSRBuilder(nodes)
+        for node_id in nodes:
+            for neighbor_id, edge in adjacency.get(node_id, {}).items():
+                builder.add_edge(neighbor_id, edge['distance'], edge.get('direction'),
+                                 edge.get('safety_score', 0.0),
+                                 edge.get('weight', edge['distance']))
+            builder.end_node()
+        return builder.finish(nodes)
+
+    @property
+    def reverse(self):
+        """
+        The incoming edges in CSR form, built on first use: (offsets, sources, edge_ids).
+        The incoming edges of node v are positions offsets[v]:offsets[v+1]; sources holds the
+        node each edge comes from and edge_ids its position in the forward edge columns,
+        so any weight column can be read for it.
+        """
+        if self._reverse is None:
+            n = self.node_count
+            counts = [0] * (n + 1)
+            for target in self.targets:
+                counts[target + 1] += 1
+            for i in range(n):
+                counts[i + 1] += counts[i]
+
+            offsets = array('I', counts)
+            sources = array('I', bytes(4 * self.edge_count))
+            edge_ids = array('I', bytes(4 * self.edge_count))
+            position = counts[:-1]
+            for u in range(n):
+                for e in range(self.offsets[u], self.offsets[u + 1]):
+                    v = self.targets[e]
+                    sources[position[v]] = u
+                    edge_ids[position[v]] = e
+                    position[v] += 1
+            self._reverse = (offsets, sources, edge_ids)
+        return self._reverse
+
+    @property
+    def edge_sources(self):
+        # Node index every edge starts from (numpy array), for vectorized work over the edge columns
+        if self._edge_sources is None:
+            offsets = np.asarray(self.offsets, dtype=np.int64)
+            self._edge_sources = np.repeat(np.arange(self.node_count), np.diff(offsets))
+        return self._edge_sources
+
+    @property
+    def spatial_index(self):
+        # KD-tree over the node coordinates, built on first use (see spatial_index.py)
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.latitude, self.longitude)
+        return self._spatial_index
+
+    @property
+    def heuristic_scale(self):
+        # Factor that keeps straight-line distances below every edge weight (see geodesic.py)
+        if self._heuristic_scale is None:
+            self._heuristic_scale = admissible_scale(self)
+        return self._heuristic_scale
+
+    @property
+    def distance_scale(self):
+        # The same factor checked against the real distances. Every weighting makes an edge at
+        # least as long as its distance, so this one is admissible for all of them and never
+        # has to be recomputed when weights change
+        if self._distance_scale is None:
+            self._distance_scale = admissible_scale(self, self.distance)
+        return self._distance_scale
+
+    def weights_changed(self, increased=False):
+        """
+        Called after safety scores and edge weights were patched in place (distances never
+        change). Bumps the version and drops the weight-derived structures, except those
+        marked distance_only = True (e.g. the shortest profile's hierarchy and landmarks),
+        which never read the safety scores. When every changed weight only went up, lower
+        bounds computed from the old weights are still lower bounds, so the heuristic scale
+        and structures with valid_after_increase = True (e.g. landmarks) are kept as well.
+        """
+        self.version += 1
+        if not increased:
+            self._heuristic_scale = None
+        for name, structure in list(self.derived.items()):
+            if getattr(structure, 'distance_only', False):
+                continue
+            if not (increased and getattr(structure, 'valid_after_increase', False)):
+                del self.derived[name]
+
+    def nearest(self, coord, k=1, max_radius_m=None):
+        """
+        Returns up to k (node_id, distance in metres) pairs for the nodes closest to
+        coord = (latitude, longitude), closest first, ignoring nodes beyond max_radius_m.
+        """
+        return [(self.node_ids[i], distance_m)
+                for distance_m, i in self.spatial_index.nearest(coord, k, max_radius_m)]
+
+    def coordinate(self, i):
+        latitude = self.latitude[i]
+        if math.isnan(latitude):
+            return None
+        return (latitude, self.longitude[i])
+
+    def edges(self, i):
+        # Returns (neighbor_id, edge dict) for every outgoing edge of node index i
+        for e in range(self.offsets[i], self.offsets[i + 1]):
+            code = self.direction[e]
+            yield self.node_ids[self.targets[e]], {
+                'distance': self.distance[e],
+                'direction': None if code == NO_DIRECTION else self.directions[code],
+                'safety_score': self.safety_score[e],
+                'weight': self.weight[e]
+            }
+
+    def path_ids(self, path):
+        # Converts a list of node indexes into a list of node ids
+        return [self.node_ids[i] for i in path]
+
+
+class CSRBuilder:
+    """
+    Collects edges node by node (in the order of the nodes dict) and produces a CSRGraph.
+    Call add_edge for each outgoing edge of the current node, then end_node.
+    """
+
+    def __init__(self, nodes):
+        self.node_ids = list(nodes)
+        self.index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+        self.latitude = array('d')
+        self.longitude = array('d')
+        for node_id in self.node_ids:
+            coordinate = nodes[node_id].coordinate
+            if isinstance(coordinate, (list, tuple)) and len(coordinate) == 2:
+                self.latitude.append(float(coordinate[0]))
+                self.longitude.append(float(coordinate[1]))
+            else:
+                self.latitude.append(math.nan)
+                self.longitude.append(math.nan)
+
+        self.offsets = array('I', [0])
+        self.targets = array('I')
+        self.distance = array('d')
+        self.weight = array('d')
+        self.safety_score = array('d')
+        self.direction = array('B')
+        self.directions = []
+        self._direction_codes = {}
+
+    def add_edge(self, neighbor_id, distance, direction, safety_score, weight):
+        self.targets.append(self.index[neighbor_id])
+        self.distance.append(distance)
+        self.weight.append(weight)
+        self.safety_score.append(safety_score)
+
+        if direction is None:
+            self.direction.append(NO_DIRECTION)
+        else:
+            code = self._direction_codes.get(direction)
+            if code is None:
+                code = self._direction_codes[direction] = len(self.directions)
+                self.directions.append(direction)
+            self.direction.append(code)
+
+    def end_node(self):
+        self.offsets.append(len(self.targets))
+
+    def finish(self, nodes=None):
+        return CSRGraph(self.node_ids, self.latitude, self.longitude, self.offsets,
+                        self.targets, self.distance, self.weight, self.safety_score,
+                        self.direction, self.directions, nodes)
+
+
+def as_csr(graph):
+    """
+    Returns the CSRGraph behind a graph object: the graph itself, the .csr of a built
+    create_graph, or a CSRGraph converted from a plain nodes/adjacency graph.
+    """
+    if isinstance(graph, CSRGraph):
+        return graph
+    csr = getattr(graph, 'csr', None)
+    if csr is None:
+        csr = CSRGraph.from_adjacency(graph.nodes, graph.adjacency)
+    return csr
+
+
+class _NodesView(Mapping):
+    # node_id -> create_nodes object (coordinate and connections, no images)
+
+    def __init__(self, graph):
+        self._graph = graph
+        self._built = {}
+
+    def __getitem__(self, node_id):
+        node = self._built.get(node_id)
+        if node is None:
+            i = self._graph.index[node_id]
+            node = create_nodes(node_id, self._graph.coordinate(i))
+            for neighbor_id, edge in self._graph.edges(i):
+                node.add_connection(neighbor_id, edge['distance'], edge['direction'])
+            self._built[node_id] = node
+        return node
+
+    def __iter__(self):
+        return iter(self._graph.node_ids)
+
+    def __len__(self):
+        return len(self._graph.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._graph.index
+
+
+class _AdjacencyView(Mapping):
+    # node_id -> {neighbor_id: edge dict}, the same shape as the old create_graph.adjacency.
+    # The dicts are built on each lookup, so changing them does not change the graph.
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node_id):
+        return dict(self._graph.edges(self._graph.index[node_id]))
+
+    def __iter__(self):
+        return iter(self._graph.node_ids)
+
+    def __len__(self):
+        return len(self._graph.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._graph.index
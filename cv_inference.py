@@ -1,26 +1,110 @@
-from ultralytics import YOLO
+import ast
+import os
 import cv2
+import numpy as np
+from score_cache import model_digest, image_digest
+from create_nodes import decode_image, load_images, resize_short_side
 
 class RoadScanner:
     """
     A wrapper class for the YOLOv8 classification model.
     It simplifies the complex model output into a simple score for the graph.
+
+    The backend depends on the model file: a .pt file runs with ultralytics/torch, an .onnx
+    file (exported by train_model.py) runs with onnxruntime, which starts much faster and
+    needs far less memory. Both give the same reports.
     """
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, batch_size=32, cache=None, decode_workers=None):
         """
         Initialize the scanner by loading the trained weights.
         
         Args:
-            model_path (str): Path to the .pt file (e.g., 'runs/detect/train/weights/best.pt')
+            model_path (str): Path to the .pt or .onnx file (e.g., 'runs/detect/train/weights/best.pt')
+            batch_size (int): How many images scan_batch sends through the network at once.
+            cache (HazardScoreCache): Optional on-disk score cache (see score_cache.py).
+                                      Images already scored with these weights are not rescanned.
+            decode_workers (int): Threads used to decode lazy images (defaults to one per core).
         """
         print(f"Loading AI Model from {model_path}...")
         try:
-            self.model = YOLO(model_path)
+            if os.path.splitext(model_path)[1].lower() == '.onnx':
+                imgsz = self._load_onnx(model_path)
+            else:
+                imgsz = self._load_ultralytics(model_path)
         except Exception as e:
             print(f"Error loading model: {e}")
             raise
 
+        self.batch_size = batch_size
+        self.cache = cache
+        self.decode_workers = decode_workers
+        # Fingerprint of the weights, so cached scores from another model are never reused
+        self.weights_hash = model_digest(model_path)
+
+        # The input resolution the model was trained at (saved with the weights).
+        # scan_batch resizes every frame to this size itself so the whole batch
+        # can be handed to the network as one tensor.
+        if isinstance(imgsz, (list, tuple)):
+            imgsz = imgsz[0]
+        self.imgsz = int(imgsz)
+
+        # We need to find which index corresponds to "hazardous"
+        # because YOLO might assign it index 0 or index 1 depending on folder order.
+        self.hazard_index = None
+        for k, v in self.names.items():
+            if v == 'hazardous':
+                self.hazard_index = k
+                break
+
+    def _load_ultralytics(self, model_path):
+        # torch and ultralytics are only imported when a .pt model is used
+        from ultralytics import YOLO
+        import torch
+
+        self.backend = 'ultralytics'
+        self.model = YOLO(model_path)
+        self.names = self.model.names   # e.g., {0: 'hazardous', 1: 'safe'}
+        self._torch = torch
+        return self.model.overrides.get('imgsz', 224)
+
+    def _load_onnx(self, model_path, threads=None):
+        import onnxruntime
+
+        self.backend = 'onnx'
+        self.model_path = model_path
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.model = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.model.get_inputs()[0]
+        self._input_name = model_input.name
+        # Models exported without dynamic=True only take one image per call
+        self._fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+        # ultralytics stores the class names and input size as Python literals in the metadata
+        metadata = self.model.get_modelmeta().custom_metadata_map
+        # Dynamic int8 models (train_model.export_onnx(int8=True)) pick their activation scale
+        # from the whole input tensor, so an image's score would depend on the rest of its
+        # batch. They are run one image per call, like fixed batch models.
+        if metadata.get('quantization') == 'dynamic' or model_path.endswith('.int8.onnx'):
+            self._fixed_batch = 1
+        self.names = {int(k): v for k, v in ast.literal_eval(metadata.get('names', '{}')).items()}
+        if 'imgsz' in metadata:
+            return ast.literal_eval(metadata['imgsz'])
+        height = model_input.shape[2]
+        return height if isinstance(height, int) else 224
+
+    def set_threads(self, threads):
+        """
+        Sets how many CPU threads one forward pass may use (e.g. 1 per forked web worker).
+        """
+        if self.backend == 'onnx':
+            # onnxruntime fixes the thread count when the session is created
+            self._load_onnx(self.model_path, threads)
+        else:
+            self._torch.set_num_threads(threads)
+
     def scan_image(self, image_source):
         """
         Analyzes a single image and returns a hazard report.
@@ -28,30 +112,141 @@ class RoadScanner:
         Args:
             image_source: Can be a file path (str) OR a numpy array (loaded by cv2.imread).
                           This flexibility is crucial because create_nodes.py loads images 
-                          as numpy arrays.
+                          as numpy arrays. A create_nodes.LazyImage handle works too.
         
         Returns:
             dict: Contains 'is_hazardous' (bool), 'hazard_score' (0.0-1.0), and the label.
         """
+        # Lazy handles from create_nodes.py are decoded on demand, straight to the model size
+        if isinstance(image_source, str):
+            path = image_source
+            image_source = decode_image(path, self.imgsz)
+            if image_source is None:
+                raise FileNotFoundError(f"Could not read image: {path}")
+        elif not isinstance(image_source, np.ndarray):
+            image_source = image_source.load(self.imgsz)
+
         # Run the image through the neural network
-        results = self.model(image_source, verbose=False)
-        
-        # The result object contains 'probs' (probabilities)
-        probs = results[0].probs
-        class_dict = results[0].names  # e.g., {0: 'hazardous', 1: 'safe'}
-        
-        # We need to find which index corresponds to "hazardous"
-        # because YOLO might assign it index 0 or index 1 depending on folder order.
-        hazard_index = None
-        for k, v in class_dict.items():
-            if v == 'hazardous':
-                hazard_index = k
-                break
-        
+        probabilities = self._forward(self._preprocess([image_source]))
+        return self._to_report(probabilities[0])
+
+    def scan_batch(self, images, batch_size=None):
+        """
+        Analyzes many images with as few forward passes as possible.
+
+        Identical frames are only scanned once, frames found in the score cache
+        are not scanned at all, every other frame is resized to the model's
+        input size, and the frames are run through the network in fixed-size
+        batches instead of one call per image.
+
+        Args:
+            images (list): numpy arrays (loaded by cv2.imread) or create_nodes.LazyImage
+                           handles. Entries that are None (missing pictures) are skipped.
+            batch_size (int): Overrides the batch size given to the constructor.
+
+        Returns:
+            list: One report per input (same format as scan_image), None where the
+                  input was None.
+        """
+        batch_size = batch_size or self.batch_size
+        reports = [None] * len(images)
+
+        # Group the inputs by content so duplicates share one forward pass
+        unique_frames = []
+        positions = {}
+        for i, image in enumerate(images):
+            if image is None:
+                continue
+            key = image_digest(image)
+            if key not in positions:
+                positions[key] = []
+                unique_frames.append((key, image))
+            positions[key].append(i)
+
+        # Reuse the scores of every image this model has already seen
+        if self.cache is not None and unique_frames:
+            cached = self.cache.get_many([key for key, _ in unique_frames], self.weights_hash)
+            for key, report in cached.items():
+                for i in positions[key]:
+                    reports[i] = report
+            unique_frames = [(key, image) for key, image in unique_frames if key not in cached]
+
+        new_reports = {}
+        for start in range(0, len(unique_frames), batch_size):
+            keys, images_in_chunk = zip(*unique_frames[start:start + batch_size])
+
+            # Lazy handles (create_nodes.LazyImage) are decoded here in parallel, straight to
+            # the model's input resolution, and only when the score wasn't cached
+            frames = load_images(images_in_chunk, self.imgsz, self.decode_workers)
+            chunk = [(key, frame) for key, frame in zip(keys, frames) if frame is not None]
+            if not chunk:
+                continue
+
+            batch = self._preprocess([frame for _, frame in chunk])
+            probabilities = self._forward(batch)
+
+            for (key, _), row in zip(chunk, probabilities):
+                report = self._to_report(row)
+                new_reports[key] = report
+                for i in positions[key]:
+                    reports[i] = report
+
+        if self.cache is not None and new_reports:
+            self.cache.put_many(new_reports, self.weights_hash)
+
+        return reports
+
+    def _preprocess(self, frames):
+        """
+        Turns a list of BGR frames into one (N, 3, imgsz, imgsz) float32 array.
+
+        Same steps as ultralytics' classify_transforms, which model.predict
+        uses: resize the short side to imgsz (bilinear, see
+        create_nodes.resize_short_side), then center crop to imgsz x imgsz.
+        Every frame is written into one preallocated buffer and the whole
+        batch is converted at once.
+        """
+        size = self.imgsz
+        batch = np.empty((len(frames), size, size, 3), dtype=np.uint8)
+
+        for i, frame in enumerate(frames):
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            frame = resize_short_side(frame[:, :, :3], size)
+            height, width = frame.shape[:2]
+            # torchvision's CenterCrop rounds the offsets
+            top = int(round((height - size) / 2.0))
+            left = int(round((width - size) / 2.0))
+            batch[i] = frame[top:top + size, left:left + size]
+
+        # BGR -> RGB, HWC -> CHW and 0-255 -> 0.0-1.0 for the whole batch in one step
+        tensor = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+        tensor /= 255.0
+        return tensor
+
+    def _forward(self, batch):
+        """
+        Runs a preprocessed batch through the network.
+        Returns an (N, classes) array of class probabilities.
+        """
+        if self.backend == 'onnx':
+            # The exported classifier already ends in a softmax
+            if self._fixed_batch:
+                rows = [self.model.run(None, {self._input_name: batch[i:i + 1]})[0] for i in range(len(batch))]
+                return np.concatenate(rows)
+            return self.model.run(None, {self._input_name: batch})[0]
+
+        results = self.model(self._torch.from_numpy(batch), verbose=False)
+        return np.stack([result.probs.data.cpu().numpy() for result in results])
+
+    def _to_report(self, probabilities):
+        """
+        Converts one row of class probabilities into the dictionary the graph builder uses.
+        """
         # If the model predicts the "hazardous" class, get that probability.
         # If 'hazardous' wasn't one of the classes, default to 0.0.
-        if hazard_index is not None:
-            hazard_prob = float(probs.data[hazard_index])
+        if self.hazard_index is not None:
+            hazard_prob = float(probabilities[self.hazard_index])
         else:
             hazard_prob = 0.0
         
@@ -59,17 +254,53 @@ class RoadScanner:
         return {
             "is_hazardous": hazard_prob > 0.5, # True if more than 50% sure it's bad
             "hazard_score": hazard_prob,       # Exact score (e.g., 0.85)
-            "prediction": class_dict[probs.top1] # The text label (e.g., "hazardous")
+            "prediction": self.names[int(np.argmax(probabilities))] # The text label (e.g., "hazardous")
         }
 
+def check_parity(scanner, model_path, paths):
+    """
+    Compares the scanner's hazard scores with ultralytics' own model.predict on the same files,
+    once from arrays (cv2.imread) and once from lazy handles (decoded to the model size).
+    All three should agree to float rounding; a larger gap means _preprocess no longer
+    matches the transforms the model was trained with.
+
+    Returns:
+        list: (path, predict score, array score, lazy score) per image.
+    """
+    from ultralytics import YOLO
+    from create_nodes import LazyImage
+
+    model = scanner.model if scanner.backend == 'ultralytics' else YOLO(model_path, task='classify')
+    from_arrays = scanner.scan_batch([cv2.imread(path) for path in paths])
+    from_handles = scanner.scan_batch([LazyImage(path) for path in paths])
+
+    rows = []
+    for path, array_report, lazy_report in zip(paths, from_arrays, from_handles):
+        # Exported models don't tell predict their input size (it would use 640)
+        probabilities = model.predict(path, imgsz=scanner.imgsz, verbose=False)[0].probs.data.cpu().numpy()
+        rows.append((path, scanner._to_report(probabilities)['hazard_score'],
+                     array_report['hazard_score'], lazy_report['hazard_score']))
+    return rows
+
+def check_batch_consistency(scanner, paths):
+    """
+    Scores every file on its own and then all of them in one batch. An image's score must not
+    depend on which other images share its forward pass, so both should agree to float rounding.
+
+    Returns:
+        list: (path, score alone, score in the batch) per image.
+    """
+    alone = [scanner.scan_batch([cv2.imread(path)])[0]['hazard_score'] for path in paths]
+    batched = scanner.scan_batch([cv2.imread(path) for path in paths], batch_size=len(paths))
+    return [(path, single, report['hazard_score']) for path, single, report in zip(paths, alone, batched)]
+
 # TEST BLOCK
 # This only runs if you run this file directly (not when imported by create_graph.py)
 if __name__ == "__main__":
     # Define where the trained model lives
-    model_path = 'road_safety_project/hazard_classifier/weights/best.pt'
+    model_path = 'road_safety_project/hazard_classifier2/weights/best.pt'
     
     # Check if the model exists before trying to load it
-    import os
     if os.path.exists(model_path):
         scanner = RoadScanner(model_path)
         
@@ -81,5 +312,18 @@ if __name__ == "__main__":
             print(result)
         else:
             print(f"Test image not found: {test_img}")
+
+        # The scores must match what ultralytics itself gives for the same files
+        sample_dir = 'data/sample_images'
+        samples = sorted(os.path.join(sample_dir, name) for name in os.listdir(sample_dir))
+        worst = 0.0
+        for path, expected, from_array, from_lazy in check_parity(scanner, model_path, samples):
+            worst = max(worst, abs(expected - from_array), abs(expected - from_lazy))
+            print(f"{os.path.basename(path)}: predict {expected:.4f}, array {from_array:.4f}, lazy {from_lazy:.4f}")
+        print(f"Largest difference to model.predict: {worst:.2e}" + (" (MISMATCH)" if worst > 1e-4 else ""))
+
+        # ...and must not change with the other images in the batch
+        worst = max(abs(single - batched) for _, single, batched in check_batch_consistency(scanner, samples))
+        print(f"Largest difference alone vs in a batch: {worst:.2e}" + (" (MISMATCH)" if worst > 1e-4 else ""))
     else:
-        print("Model file not found. Run train_model.py first!")
\ No newline at end of file
+        print("Model file not found. Run train_model.py first!")
@@ -1,50 +1,194 @@
 import heapq
 
-def Dijkstra(graph, start_node_id, end_node_id):
-    
-    print("Running Dijkstra's Algorithm...")
-
-    queue = []
-    heapq.heappush(queue, (0, start_node_id))
-
-    distances = {node_id: float('inf') for node_id in graph.nodes}
-    distances[start_node_id] = 0
-
-    previous_nodes = {node_id: None for node_id in graph.nodes}
+from csr_graph import as_csr
 
+def _expand(queue, distances, previous_nodes, offsets, targets, weights, end):
+    # The search loop without a trace: nothing but the search itself
     while queue:
-        current_distance, current_node_id = heapq.heappop(queue)
+        current_distance, current = heapq.heappop(queue)
 
         # Early exit
-        if current_node_id == end_node_id:
+        if current == end:
             break
 
-        if current_distance > distances[current_node_id]:
+        if current_distance > distances[current]:
+            continue
+
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            distance = current_distance + weights[e]
+
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                previous_nodes[neighbor] = current
+                heapq.heappush(queue, (distance, neighbor))
+
+def _expand_traced(queue, distances, previous_nodes, offsets, targets, weights, end):
+    # The same loop, counting what it does; returns (popped, relaxed, stale)
+    popped = relaxed = stale = 0
+    while queue:
+        current_distance, current = heapq.heappop(queue)
+        popped += 1
+        if current == end:
+            break
+        if current_distance > distances[current]:
+            stale += 1
             continue
 
-        for neighbor_id, edge_data in graph.adjacency.get(current_node_id, {}).items():
-            weight = edge_data['weight']
-            distance = current_distance + weight
+        first, last = offsets[current], offsets[current + 1]
+        relaxed += last - first
+        for e in range(first, last):
+            neighbor = targets[e]
+            distance = current_distance + weights[e]
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                previous_nodes[neighbor] = current
+                heapq.heappush(queue, (distance, neighbor))
+    return popped, relaxed, stale
+
+def Dijkstra(graph, start_node_id, end_node_id, trace=None, weights=None):
+    # Works on the integer-indexed CSR arrays of the graph (see csr_graph.py)
+    # Pass trace=SearchTrace() (see search_trace.py) to record what the search did
+    # weights replaces the graph's edge weights (e.g. weight_profiles.edge_weights)
+    if trace is not None:
+        trace.start()
+    csr = as_csr(graph)
+    if start_node_id not in csr.index or end_node_id not in csr.index:
+        return [end_node_id], float('inf')
+
+    start = csr.index[start_node_id]
+    end = csr.index[end_node_id]
+    offsets, targets = csr.offsets, csr.targets
+    if weights is None:
+        weights = csr.weight
+
+    queue = []
+    heapq.heappush(queue, (0, start))
 
-            print(
-                f"{current_node_id} → {neighbor_id} | "
-                f"base={edge_data.get('distance', '?')} "
-                f"safety={edge_data.get('safety_score', 0.0):.2f} "
-                f"weight={edge_data['weight']:.2f} "
-                f"total_dist={distance:.2f}"
-            )
+    distances = [float('inf')] * csr.node_count
+    distances[start] = 0
 
-            if distance < distances[neighbor_id]:
-                distances[neighbor_id] = distance
-                previous_nodes[neighbor_id] = current_node_id
-                heapq.heappush(queue, (distance, neighbor_id))
+    previous_nodes = [-1] * csr.node_count
+
+    # The counting loop only runs when the search is traced
+    if trace is None:
+        _expand(queue, distances, previous_nodes, offsets, targets, weights, end)
+    else:
+        popped, relaxed, stale = _expand_traced(queue, distances, previous_nodes, offsets, targets, weights, end)
+        trace.mark('search')
+        # Every pushed entry was either popped or is still on the heap
+        trace.count(popped, relaxed, popped + len(queue), stale)
 
     # Reconstruct path
     path = []
-    current_node_id = end_node_id
-    while current_node_id is not None:
-        path.append(current_node_id)
-        current_node_id = previous_nodes[current_node_id]
+    current = end
+    while current != -1:
+        path.append(current)
+        current = previous_nodes[current]
     path.reverse()
 
-    return path, distances[end_node_id]
\ No newline at end of file
+    if trace is not None:
+        trace.mark('path')
+    return csr.path_ids(path), distances[end]
+
+
+def shortest_path_tree(graph, source_node_id, targets=None, weights=None, limit=None, bounds=None):
+    # Single-source Dijkstra from one node to every node it can reach.
+    # Given targets (node ids), it stops once all of them are settled; entries of other
+    # nodes may then be unfinished. weights replaces the graph's edge weights.
+    # Given limit, only nodes within that cost are reached (the others stay inf). bounds (a
+    # lower bound of the cost onwards from every node index, e.g. reverse tree costs) narrows
+    # that to the nodes whose cost plus bound is within limit.
+    # Returns three lists indexed by node index (see csr_graph.py):
+    #   costs   - total weight of the best path (inf if unreachable)
+    #   lengths - real distance (metres) along that same path
+    #   previous - parent node index on the path, -1 for the source and unreachable nodes
+    csr = as_csr(graph)
+    source = csr.index[source_node_id]
+    remaining = None if targets is None else {csr.index[node_id] for node_id in targets}
+    offsets, targets = csr.offsets, csr.targets
+    base_distances = csr.distance
+    if weights is None:
+        weights = csr.weight
+    if limit is None:
+        limit = float('inf')
+
+    costs = [float('inf')] * csr.node_count
+    lengths = [float('inf')] * csr.node_count
+    previous = [-1] * csr.node_count
+    costs[source] = 0.0
+    lengths[source] = 0.0
+
+    queue = [(0.0, source)]
+    while queue:
+        current_cost, current = heapq.heappop(queue)
+        if current_cost > costs[current]:
+            continue
+        if remaining is not None:
+            remaining.discard(current)
+            if not remaining:
+                break
+
+        current_length = lengths[current]
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            cost = current_cost + weights[e]
+            if cost < costs[neighbor] and cost <= limit and (bounds is None or cost + bounds[neighbor] <= limit):
+                costs[neighbor] = cost
+                lengths[neighbor] = current_length + base_distances[e]
+                previous[neighbor] = current
+                heapq.heappush(queue, (cost, neighbor))
+
+    return costs, lengths, previous
+
+
+def reverse_shortest_path_tree(graph, target_node_id, weights=None, limit=None):
+    # shortest_path_tree backwards: the best route from every node *to* one target, grown over
+    # the incoming edges (csr.reverse). Returns the same three lists, except that the third one
+    # holds the next node index on the way to the target (-1 for the target and unreachable nodes)
+    # Given limit, only nodes within that cost of the target are reached (the others stay inf).
+    csr = as_csr(graph)
+    target = csr.index[target_node_id]
+    offsets, sources, edge_ids = csr.reverse
+    base_distances = csr.distance
+    if weights is None:
+        weights = csr.weight
+    if limit is None:
+        limit = float('inf')
+
+    costs = [float('inf')] * csr.node_count
+    lengths = [float('inf')] * csr.node_count
+    following = [-1] * csr.node_count
+    costs[target] = 0.0
+    lengths[target] = 0.0
+
+    queue = [(0.0, target)]
+    while queue:
+        current_cost, current = heapq.heappop(queue)
+        if current_cost > costs[current]:
+            continue
+
+        current_length = lengths[current]
+        for i in range(offsets[current], offsets[current + 1]):
+            neighbor = sources[i]
+            e = edge_ids[i]
+            cost = current_cost + weights[e]
+            if cost < costs[neighbor] and cost <= limit:
+                costs[neighbor] = cost
+                lengths[neighbor] = current_length + base_distances[e]
+                following[neighbor] = current
+                heapq.heappush(queue, (cost, neighbor))
+
+    return costs, lengths, following
+
+
+def tree_path(graph, previous, target_node_id):
+    # Reads the path from the source of a shortest_path_tree to a target node (list of node ids)
+    csr = as_csr(graph)
+    path = []
+    current = csr.index[target_node_id]
+    while current != -1:
+        path.append(current)
+        current = previous[current]
+    path.reverse()
+    return csr.path_ids(path)
@@ -0,0 +1,108 @@
+# This file holds the great-circle (haversine) distance code shared by the whole project.
+# Everything is in metres, the same unit as the "Distances" in image_metadata.json.
+# haversine() is the scalar version for single pairs of coordinates; haversine_pairs(),
+# haversine_matrix() and heuristic_to() work on whole numpy arrays at once.
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine(a, b):
+    """
+    Great-circle distance in metres between two (latitude, longitude) points in decimal degrees.
+    """
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    dlat, dlon = lat2 - lat1, lon2 - lon1
+    sa = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(sa))
+
+
+def haversine_pairs(lat1, lon1, lat2, lon2):
+    """
+    Element-wise great-circle distances in metres: point i of the first set to point i of
+    the second. All inputs are (N,) arrays (or scalars, broadcast) in decimal degrees.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+
+    sa = (np.sin((lat2 - lat1) / 2) ** 2
+          + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(sa, 1.0)))
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distances in metres between every pair of two sets of points.
+
+    Args:
+        lat1, lon1: (N,) decimal degrees.
+        lat2, lon2: (M,) decimal degrees.
+
+    Returns:
+        numpy.ndarray: (N, M) distances.
+    """
+    lat1 = np.atleast_1d(np.asarray(lat1, dtype=np.float64))[:, np.newaxis]
+    lon1 = np.atleast_1d(np.asarray(lon1, dtype=np.float64))[:, np.newaxis]
+    lat2 = np.atleast_1d(np.asarray(lat2, dtype=np.float64))[np.newaxis, :]
+    lon2 = np.atleast_1d(np.asarray(lon2, dtype=np.float64))[np.newaxis, :]
+    return haversine_pairs(lat1, lon1, lat2, lon2)
+
+
+def admissible_scale(csr, weights=None):
+    """
+    Returns the largest factor s <= 1 such that s * (straight-line distance) never exceeds
+    the weight of any edge.
+
+    The metadata distances are measured along the roads but the coordinates are rounded
+    to whole seconds, so a few edges are "shorter" than the straight line between their
+    ends. Scaling the heuristic by s keeps A* admissible (and consistent) on any graph.
+
+    Args:
+        csr (CSRGraph): The graph.
+        weights: Edge costs to check against (defaults to csr.weight).
+    """
+    weights = np.asarray(csr.weight if weights is None else weights, dtype=np.float64)
+    if len(weights) == 0:
+        return 1.0
+
+    sources = csr.edge_sources
+    targets = np.asarray(csr.targets, dtype=np.int64)
+    latitude = np.asarray(csr.latitude, dtype=np.float64)
+    longitude = np.asarray(csr.longitude, dtype=np.float64)
+
+    straight = haversine_pairs(latitude[sources], longitude[sources],
+                               latitude[targets], longitude[targets])
+
+    # Edges with an unknown coordinate (NaN) or zero length don't limit the scale
+    usable = straight > 0
+    if not np.any(usable):
+        return 1.0
+    return float(min(1.0, np.min(weights[usable] / straight[usable])))
+
+
+def heuristic_to(csr, goal, scale=1.0):
+    """
+    Lower bound (metres) of the cost from every node to the goal, computed in one
+    vectorized call. Nodes without a coordinate get 0.0.
+
+    Args:
+        csr (CSRGraph): The graph.
+        goal (int): Node index of the goal.
+        scale (float): Multiplier from admissible_scale, keeps the bound admissible.
+
+    Returns:
+        list: One float per node index (a list is the fastest for scalar lookups in A*).
+    """
+    latitude = np.asarray(csr.latitude, dtype=np.float64)
+    longitude = np.asarray(csr.longitude, dtype=np.float64)
+    if math.isnan(latitude[goal]) or math.isnan(longitude[goal]):
+        return [0.0] * csr.node_count
+
+    distances = haversine_pairs(latitude, longitude, latitude[goal], longitude[goal]) * scale
+    return np.nan_to_num(distances, nan=0.0).tolist()
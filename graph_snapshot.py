@@ -0,0 +1,233 @@
+# This file compiles a finished graph into a single binary snapshot file so later runs can skip
+# parsing the metadata, converting coordinates, loading images and running the AI model.
+# The snapshot is memory-mapped when loaded: start-up only reads the small header, and every
+# process that maps the same file (e.g. forked web workers) shares the same pages.
+#
+# The header records the hash of image_metadata.json and of the model weights. If either one
+# changes, load_graph ignores the old snapshot and compiles a new one.
+#
+# Layout (little endian):
+#   header  magic, version, node count, edge count, metadata hash, weights hash, strings length,
+#           first year and year count of the hazard profiles (0 years = none)
+#   strings JSON list of node ids and the table of direction names (padded to 8 bytes)
+#   float64 latitude[n], longitude[n]
+#   float64 distance[m], weight[m], safety_score[m]
+#   uint32  offsets[n + 1], targets[m]      (CSR: edges of node i are offsets[i]:offsets[i+1])
+#   uint8   direction[m]                    (index into the direction table, 255 = no direction)
+#   float32 hazard profiles[n * years]      (row per node, see hazard_profile.py)
+
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+import numpy as np
+
+from csr_graph import CSRGraph, as_csr
+from hazard_profile import HazardProfiles
+from score_cache import file_digest, model_digest
+
+directory = os.path.dirname(__file__)
+DEFAULT_SNAPSHOT_PATH = os.path.join(directory, 'cache', 'graph.snapshot')
+DEFAULT_MODEL_PATH = os.path.join(directory, 'road_safety_project', 'hazard_classifier2', 'weights', 'best.pt')
+METADATA_PATH = os.path.join(directory, 'image_metadata.json')
+
+SNAPSHOT_MAGIC = b'RSMSGRPH'
+SNAPSHOT_VERSION = 2
+HEADER = struct.Struct('<8sIII40s40sQiI')
+
+
+def source_hashes(model_path=DEFAULT_MODEL_PATH):
+    """
+    Returns (metadata hash, weights hash) for the files a graph is built from.
+    The weights hash is '' when the model file does not exist.
+    """
+    weights_hash = model_digest(model_path) if os.path.isfile(model_path) else ''
+    return file_digest(METADATA_PATH), weights_hash
+
+
+def _pad(f):
+    # Keeps every array aligned to 8 bytes so it can be cast straight out of the mmap
+    f.write(b'\0' * (-f.tell() % 8))
+
+
+def compile_snapshot(graph, path=DEFAULT_SNAPSHOT_PATH, metadata_hash='', weights_hash=''):
+    """
+    Writes a built graph (create_graph after build_graph, or a CSRGraph) to a snapshot file.
+
+    Args:
+        graph: The built graph.
+        path (str): Where to write the snapshot.
+        metadata_hash (str): Hash of the image_metadata.json the graph was built from.
+        weights_hash (str): Hash of the model weights used for the safety scores.
+    """
+    csr = as_csr(graph)
+    profiles = csr.hazard_profiles
+    first_year, year_count = (0, 0) if profiles is None else (profiles.first_year, profiles.scores.shape[1])
+    strings = json.dumps({'nodes': csr.node_ids, 'directions': csr.directions}).encode('utf-8')
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Write to a temporary file first so a running process never maps a half-written snapshot
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, csr.node_count, csr.edge_count,
+                            metadata_hash.encode('ascii').ljust(40),
+                            weights_hash.encode('ascii').ljust(40), len(strings), first_year, year_count))
+        f.write(strings)
+        _pad(f)
+        for fmt, column in (('d', csr.latitude), ('d', csr.longitude), ('d', csr.distance),
+                            ('d', csr.weight), ('d', csr.safety_score), ('I', csr.offsets),
+                            ('I', csr.targets), ('B', csr.direction)):
+            f.write(array(fmt, column).tobytes())
+            _pad(f)
+        if profiles is not None:
+            f.write(np.ascontiguousarray(profiles.scores, dtype=np.float32).tobytes())
+    os.replace(temp_path, path)
+
+
+class SnapshotGraph(CSRGraph):
+    """
+    A CSRGraph whose arrays are views into a memory-mapped snapshot file.
+    """
+
+    def __init__(self, path):
+        # Copy-on-write mapping: pages are shared with the file until an edge weight is
+        # patched in place (see create_graph.update_node_images); the file itself never changes
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        buffer = memoryview(self._mmap)
+
+        (magic, version, node_count, edge_count, metadata_hash, weights_hash,
+         strings_length, first_year, year_count) = HEADER.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} graph snapshot")
+
+        self.path = path
+        self.metadata_hash = metadata_hash.decode('ascii').strip()
+        self.weights_hash = weights_hash.decode('ascii').strip()
+
+        position = HEADER.size
+        strings = json.loads(bytes(buffer[position:position + strings_length]).decode('utf-8'))
+        position += strings_length
+        position += -position % 8
+
+        def take(fmt, count):
+            nonlocal position
+            size = struct.calcsize(fmt) * count
+            column = buffer[position:position + size].cast(fmt)
+            position += size
+            position += -position % 8
+            return column
+
+        latitude = take('d', node_count)
+        longitude = take('d', node_count)
+        distance = take('d', edge_count)
+        weight = take('d', edge_count)
+        safety_score = take('d', edge_count)
+        offsets = take('I', node_count + 1)
+        targets = take('I', edge_count)
+        direction = take('B', edge_count)
+        profiles = take('f', node_count * year_count)
+
+        super().__init__(strings['nodes'], latitude, longitude, offsets, targets,
+                         distance, weight, safety_score, direction, strings['directions'])
+        if year_count:
+            scores = np.frombuffer(profiles, dtype=np.float32).reshape(node_count, year_count)
+            self.hazard_profiles = HazardProfiles(first_year, scores)
+
+
+def load_snapshot(path=DEFAULT_SNAPSHOT_PATH, metadata_hash=None, weights_hash=None):
+    """
+    Memory-maps a snapshot. Returns None if the file is missing, unreadable, from another
+    snapshot version, or was built from different metadata / weights than the hashes given.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        graph = SnapshotGraph(path)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring graph snapshot {path} ({e})")
+        return None
+
+    if metadata_hash is not None and graph.metadata_hash != metadata_hash:
+        return None
+    if weights_hash is not None and graph.weights_hash != weights_hash:
+        return None
+    return graph
+
+
+def build_graph(model_path=DEFAULT_MODEL_PATH, routing_only=False):
+    """
+    Builds the graph from scratch: metadata, coordinates, images and AI safety scores.
+    routing_only=True takes the scores from the score cache instead of running the model,
+    which never imports OpenCV, torch or onnxruntime (see create_graph).
+    """
+    from create_nodes import open_images, parse_metadata
+    from create_graph import create_graph
+    from coordinate_conversion import dms_to_decimal
+
+    images = open_images()
+    nodes = parse_metadata(images)
+    for node in nodes.values():
+        node.coordinate = dms_to_decimal(node.coordinate)
+    graph = create_graph(model_path, routing_only=routing_only)
+    graph.build_graph(nodes)
+    return graph
+
+
+def load_graph(model_path=DEFAULT_MODEL_PATH, snapshot_path=DEFAULT_SNAPSHOT_PATH, routing_only=False):
+    """
+    Returns the graph from the snapshot if it is still up to date, otherwise builds the graph
+    and compiles a new snapshot for the next start. snapshot_path=None always rebuilds.
+    Loading a snapshot never imports the CV code; routing_only=True keeps it that way when
+    the graph has to be rebuilt (see build_graph).
+    """
+    if snapshot_path is None:
+        return build_graph(model_path, routing_only)
+
+    metadata_hash, weights_hash = source_hashes(model_path)
+    graph = load_snapshot(snapshot_path, metadata_hash, weights_hash)
+    if graph is not None:
+        return graph
+
+    graph = build_graph(model_path, routing_only)
+    # Safety scores only match the weights when every image was scored with them
+    used_weights = graph.weights_hash
+    try:
+        compile_snapshot(graph, snapshot_path, metadata_hash, used_weights)
+    except OSError as e:
+        print(f"Warning: Could not write graph snapshot. ({e})")
+    return graph
+
+
+def updatable_graph(graph, model_path=DEFAULT_MODEL_PATH):
+    """
+    Returns a create_graph whose update_node_images patches the given graph in place.
+    A freshly built graph is returned as is; a snapshot is wrapped together with the nodes
+    (and image handles) from the metadata. Loads the AI model.
+    """
+    from create_nodes import open_images, parse_metadata
+    from create_graph import create_graph
+
+    if isinstance(graph, create_graph):
+        if graph.scanner is not None:
+            return graph
+        # Built routing-only: same nodes, but with the model loaded
+        return create_graph.from_csr(graph.csr, graph.nodes, model_path)
+    return create_graph.from_csr(graph, parse_metadata(open_images()), model_path)
+
+
+# Compile step: python graph_snapshot.py rebuilds the graph and writes a fresh snapshot
+if __name__ == "__main__":
+    t0 = time.time()
+    metadata_hash, weights_hash = source_hashes()
+    graph = build_graph()
+    compile_snapshot(graph, DEFAULT_SNAPSHOT_PATH, metadata_hash, graph.weights_hash)
+    t1 = time.time()
+
+    snapshot = load_snapshot(DEFAULT_SNAPSHOT_PATH)
+    t2 = time.time()
+    print(f"Compiled {snapshot.node_count} nodes / {snapshot.edge_count} edges into {DEFAULT_SNAPSHOT_PATH}")
+    print(f"Build: {t1 - t0:.2f}s, snapshot load: {(t2 - t1) * 1000:.2f}ms")
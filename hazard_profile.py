@@ -0,0 +1,174 @@
+# This file turns the images of every node into a hazard score per year, so a route can be
+# planned "as of" any year without running the AI model again.
+#
+# Every image counts with its AI hazard score and the Severity from image_metadata.json
+# (0-3, scaled to 0.0-1.0). The score of a node in year Y is the average over the images taken
+# in or before Y, where an image loses half its weight every HALF_LIFE_YEARS years, so
+# recent photos count most and a repaired road slowly stops looking dangerous.
+#
+# The scores are kept as one float32 array of shape (nodes, years) and edge weights for any
+# year are recomputed from it in one vectorized step over the edge arrays (no graph rebuild),
+# see profile_weights. The searches take the result as their weights argument.
+
+from array import array
+
+import numpy as np
+
+from csr_graph import as_csr
+
+# Severity in image_metadata.json goes from 0 (no issue) to 3
+SEVERITY_SCALE = 3.0
+# Share of the AI score in an image's hazard (the rest comes from the recorded Severity)
+CV_SHARE = 0.5
+# An image counts half as much this many years after it was taken
+HALF_LIFE_YEARS = 3.0
+
+
+def image_hazard(report, severity):
+    # Hazard (0.0-1.0) of one image from its AI report and recorded severity (either can be None)
+    cv_score = None if report is None else report['hazard_score']
+    if severity is not None:
+        severity = min(1.0, max(0.0, severity / SEVERITY_SCALE))
+    if cv_score is None:
+        return severity
+    if severity is None:
+        return cv_score
+    return CV_SHARE * cv_score + (1.0 - CV_SHARE) * severity
+
+
+class HazardProfiles:
+    """
+    Hazard score of every node for every year from first_year to first_year + len - 1.
+
+    Attributes:
+        first_year (int): Year of column 0.
+        scores (numpy.ndarray): float32 array of shape (node_count, year_count).
+    """
+
+    def __init__(self, first_year, scores):
+        self.first_year = first_year
+        self.scores = scores
+
+    @property
+    def last_year(self):
+        return self.first_year + self.scores.shape[1] - 1
+
+    def column(self, year):
+        # Years before the first photo use the first year, later years the last one (with no
+        # newer photos every weight decays by the same factor, so the average stays the same)
+        if year is None:
+            return self.scores.shape[1] - 1
+        return min(max(int(year), self.first_year), self.last_year) - self.first_year
+
+    def node_scores(self, year=None):
+        # Hazard of every node as of year (None = the latest year), as float64
+        return self.scores[:, self.column(year)].astype(np.float64)
+
+    def extend_to(self, year):
+        # Adds columns up to year, copies of the last one (see column)
+        if year > self.last_year:
+            extra = np.repeat(self.scores[:, -1:], year - self.last_year, axis=1)
+            self.scores = np.concatenate([self.scores, extra], axis=1)
+
+    def update_node(self, i, pairs):
+        # Recomputes the row of node index i from its (year, hazard) pairs (see dated_hazards)
+        years = [year for year, _ in pairs if year is not None]
+        if years:
+            self.extend_to(max(years))
+        self.scores[i] = _profile_rows(np.zeros(len(pairs), dtype=np.int64), pairs,
+                                       1, self.first_year, self.scores.shape[1])[0]
+
+
+def _profile_rows(owners, pairs, node_count, first_year, year_count):
+    # owners[k] is the node index of image k and pairs[k] its (year, hazard)
+    # Undated images count as taken in the first year
+    years = np.array([first_year if year is None else year for year, _ in pairs], dtype=np.float64)
+    hazards = np.array([hazard for _, hazard in pairs], dtype=np.float64)
+    scores = np.zeros((node_count, year_count), dtype=np.float32)
+
+    has_images = np.zeros((node_count, year_count), dtype=bool)
+    for column in range(year_count):
+        year = first_year + column
+        weights = np.where(years <= year, 0.5 ** ((year - years) / HALF_LIFE_YEARS), 0.0)
+        total = np.bincount(owners, weights, minlength=node_count)
+        weighted = np.bincount(owners, weights * hazards, minlength=node_count)
+        has_images[:, column] = total > 0
+        scores[has_images[:, column], column] = weighted[total > 0] / total[total > 0]
+
+    # Years before a node's first photo use that photo's year (the best known state of the road)
+    for column in range(year_count - 2, -1, -1):
+        empty = ~has_images[:, column]
+        scores[empty, column] = scores[empty, column + 1]
+    return scores
+
+
+def dated_hazards(images, reports):
+    # (year, hazard) of every image of a node that has a score or a severity
+    pairs = []
+    for img_data, report in zip(images, reports):
+        hazard = image_hazard(report, img_data.get('severity'))
+        if hazard is not None:
+            pairs.append((img_data.get('year'), hazard))
+    return pairs
+
+
+def build_hazard_profiles(node_ids, images, reports):
+    """
+    Builds the per-year hazard profiles.
+
+    Args:
+        node_ids (list): Node id of every node index.
+        images (dict): node_id -> the node's image dicts (with 'year' and 'severity').
+        reports (dict): node_id -> AI report (or None) for every one of those images.
+
+    Returns:
+        HazardProfiles: None if no image has a year.
+    """
+    owners = []
+    pairs = []
+    for i, node_id in enumerate(node_ids):
+        node_pairs = dated_hazards(images.get(node_id, []), reports.get(node_id, []))
+        owners.extend([i] * len(node_pairs))
+        pairs.extend(node_pairs)
+
+    years = [year for year, _ in pairs if year is not None]
+    if not years:
+        return None
+    first_year, last_year = min(years), max(years)
+    scores = _profile_rows(np.array(owners, dtype=np.int64), pairs, len(node_ids),
+                           first_year, last_year - first_year + 1)
+    return HazardProfiles(first_year, scores)
+
+
+def profile_weights(graph, as_of_year, penalty_factor, keep=True):
+    """
+    Edge weights from the hazard profiles as of a year, with the same formula as
+    create_graph.build_graph: distance * (1 + hazard of the edge's start node * penalty_factor).
+    Computed in one vectorized step over the edge columns and kept in csr.derived until the
+    graph's weights change (see CSRGraph.weights_changed).
+
+    Args:
+        graph: The built graph (needs csr.hazard_profiles).
+        as_of_year (int): Only images taken in or before this year count (None = all of them).
+        penalty_factor (float): How much longer a fully hazardous road looks.
+        keep (bool): Store the result in csr.derived (off for one-off penalty factors).
+
+    Returns:
+        array: One float64 weight per edge, for the weights argument of the searches.
+    """
+    csr = as_csr(graph)
+    profiles = csr.hazard_profiles
+    if profiles is None:
+        raise ValueError("The graph has no hazard profiles (no image has a year)")
+
+    # Years outside the profiles give the weights of the nearest profile year, so they share its entry
+    key = ('profile_weights', profiles.column(as_of_year), penalty_factor)
+    weights = csr.derived.get(key)
+    if weights is None:
+        node_scores = profiles.node_scores(as_of_year)
+        distance = np.asarray(csr.distance, dtype=np.float64)
+        values = distance * (1 + node_scores[csr.edge_sources] * penalty_factor)
+        weights = array('d', values.tobytes())
+        if keep:
+            csr.derived[key] = weights
+    return weights
@@ -0,0 +1,94 @@
+# This file answers "which intersections can be reached from here within a budget?", e.g. every
+# node within 2 km of safety-weighted travel from an ambulance depot.
+# It is a single Dijkstra pass that stops at the budget: entries over the budget are never
+# pushed, so the heap and the bookkeeping (dicts, not per-node lists) only ever hold nodes that
+# are actually reached, however large the graph is.
+#
+# The reached area can also be outlined with the convex hull of the reached coordinates
+# (Andrew's monotone chain).
+
+import heapq
+import math
+
+from csr_graph import as_csr
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull(points):
+    """
+    Convex hull of (latitude, longitude) points, counter-clockwise in (lat, lon) without
+    repeating the first point. Fewer than three distinct points are returned as they are and
+    points on one line give its two ends.
+    """
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+
+    lower = []
+    for p in points:
+        while len(lower) >= 2 and _cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(points):
+        while len(upper) >= 2 and _cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def isochrone(graph, source, budget, weights=None, hull=False):
+    """
+    Every node reachable from source with a total cost of at most budget.
+
+    Args:
+        graph: The built graph (create_graph or CSRGraph).
+        source (str): Node id to start from.
+        budget (float): Largest cost (the same safety-weighted units as /route).
+        weights: Edge weights (e.g. weight_profiles.edge_weights), defaults to the graph's.
+        hull (bool): Also outline the reached nodes with their convex hull.
+
+    Returns:
+        dict: 'nodes', a list of (node_id, cost, distance_m) sorted by cost (distance_m is the
+              real length of that cheapest route), and 'hull', a list of (latitude, longitude)
+              or None when not asked for.
+    """
+    csr = as_csr(graph)
+    start = csr.index[source]
+    offsets, targets = csr.offsets, csr.targets
+    base_distances = csr.distance
+    if weights is None:
+        weights = csr.weight
+
+    costs = {start: 0.0}
+    lengths = {start: 0.0}
+    reached = []
+    queue = [(0.0, start)]
+    while queue:
+        current_cost, current = heapq.heappop(queue)
+        if current_cost > costs[current]:
+            continue
+        # Popped in cost order, so this is final
+        reached.append(current)
+
+        current_length = lengths[current]
+        for e in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[e]
+            cost = current_cost + weights[e]
+            if cost <= budget and cost < costs.get(neighbor, math.inf):
+                costs[neighbor] = cost
+                lengths[neighbor] = current_length + base_distances[e]
+                heapq.heappush(queue, (cost, neighbor))
+
+    outline = None
+    if hull:
+        coordinates = [csr.coordinate(i) for i in reached]
+        outline = convex_hull([c for c in coordinates if c is not None])
+
+    return {
+        'nodes': [(csr.node_ids[i], costs[i], lengths[i]) for i in reached],
+        'hull': outline
+    }
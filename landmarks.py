@@ -0,0 +1,225 @@
+# This file implements ALT routing: A* with Landmarks and the Triangle inequality.
+#
+# Preprocessing picks a few landmark nodes spread around the edge of the map and stores the
+# cost ('weight' field) from every landmark to every node and from every node to every landmark.
+# For any two nodes v and t and a landmark L the triangle inequality gives
+#     cost(v, t) >= cost(v, L) - cost(t, L)    and    cost(v, t) >= cost(L, t) - cost(L, v)
+# so the largest of these over all landmarks is a lower bound on cost(v, t). Unlike the
+# straight-line heuristic this bound is measured in the same safety-weighted costs the search
+# uses, so it stays tight when hazardous roads are inflated up to 6x.
+#
+# ALT_search runs a bidirectional A* (forward from the start, backward from the goal) with the
+# "average" landmark potentials, which keeps both directions consistent so it stops as soon as
+# the two frontiers prove the best meeting point.
+# Every named weighting profile (see weight_profiles.py) gets its own landmark costs.
+
+import heapq
+from array import array
+
+from csr_graph import as_csr
+from weight_profiles import PROFILES, edge_weights, profile_name
+
+DEFAULT_LANDMARK_COUNT = 8
+INF = float('inf')
+
+
+def _costs_from(offsets, neighbors, edge_ids, weights, source, node_count):
+    # Single-source Dijkstra over a CSR (forward edges, or reverse edges for costs *to* source)
+    costs = [INF] * node_count
+    costs[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if cost > costs[node]:
+            continue
+        for i in range(offsets[node], offsets[node + 1]):
+            neighbor = neighbors[i]
+            new_cost = cost + weights[edge_ids[i] if edge_ids is not None else i]
+            if new_cost < costs[neighbor]:
+                costs[neighbor] = new_cost
+                heapq.heappush(heap, (new_cost, neighbor))
+    return costs
+
+
+class Landmarks:
+    """
+    Landmark nodes and their costs.
+
+    Attributes:
+        nodes (list): Node index of every landmark.
+        from_landmark (list): One array per landmark, cost(landmark -> v) for every node v.
+        to_landmark (list): One array per landmark, cost(v -> landmark) for every node v.
+    """
+
+    # Costs only grow when edge weights go up, so the old bounds stay admissible (just looser)
+    valid_after_increase = True
+
+    def __init__(self, nodes, from_landmark, to_landmark):
+        self.nodes = nodes
+        self.from_landmark = from_landmark
+        self.to_landmark = to_landmark
+
+    def lower_bound(self, v, t):
+        # Lower bound of cost(v -> t) from every landmark (unreachable entries give no bound)
+        best = 0.0
+        for from_l, to_l in zip(self.from_landmark, self.to_landmark):
+            v_to, t_to = to_l[v], to_l[t]
+            if v_to != INF and t_to != INF and v_to - t_to > best:
+                best = v_to - t_to
+            l_v, l_t = from_l[v], from_l[t]
+            if l_v != INF and l_t != INF and l_t - l_v > best:
+                best = l_t - l_v
+        return best
+
+
+def build_landmarks(graph, count=DEFAULT_LANDMARK_COUNT, weights=None):
+    """
+    Picks landmarks with the "farthest" strategy (each new landmark is the node furthest from
+    the ones already picked) and computes the costs to and from each of them.
+
+    Args:
+        graph: The built graph (create_graph or CSRGraph).
+        count (int): How many landmarks to use.
+        weights: Edge costs (defaults to the graph's 'weight' column).
+    """
+    csr = as_csr(graph)
+    weights = csr.weight if weights is None else weights
+    n = csr.node_count
+    reverse_offsets, reverse_sources, reverse_edges = csr.reverse
+
+    chosen = []
+    from_landmark = []
+    to_landmark = []
+    # Cost from the nearest chosen landmark (in either direction) to every node
+    closest = [INF] * n
+
+    # Start from the node furthest from node 0, which tends to be on the edge of the map
+    candidate = 0
+    for _ in range(min(count, n)):
+        if chosen:
+            # Furthest reachable node from every landmark so far (unreachable nodes are skipped)
+            candidate = max(
+                (v for v in range(n) if v not in chosen and closest[v] != INF),
+                key=lambda v: closest[v], default=None
+            )
+            if candidate is None:
+                candidate = next(v for v in range(n) if v not in chosen)
+        else:
+            costs = _costs_from(csr.offsets, csr.targets, None, weights, 0, n)
+            reachable = [v for v in range(n) if costs[v] != INF]
+            candidate = max(reachable, key=lambda v: costs[v])
+
+        forward = _costs_from(csr.offsets, csr.targets, None, weights, candidate, n)
+        backward = _costs_from(reverse_offsets, reverse_sources, reverse_edges, weights, candidate, n)
+        chosen.append(candidate)
+        from_landmark.append(array('d', forward))
+        to_landmark.append(array('d', backward))
+        for v in range(n):
+            closest[v] = min(closest[v], forward[v], backward[v])
+
+    return Landmarks(chosen, from_landmark, to_landmark)
+
+
+def landmarks(graph, count=DEFAULT_LANDMARK_COUNT, profile=None):
+    # Returns the landmarks for the graph's current weights under a named profile
+    # (built once, then kept on the graph)
+    csr = as_csr(graph)
+    name = profile_name(profile)
+    if name not in PROFILES:
+        raise ValueError(f"Landmarks are only kept for the profiles {', '.join(PROFILES)}")
+    found = csr.derived.get(('landmarks', name))
+    if found is None or len(found.nodes) != min(count, csr.node_count):
+        found = build_landmarks(csr, count, edge_weights(csr, name))
+        # The shortest profile's landmarks only read distances, so they survive safety score updates
+        found.distance_only = PROFILES[name] == 0
+        csr.derived[('landmarks', name)] = found
+    return found
+
+
+def ALT_search(graph, start, goal, profile=None):
+    # Bidirectional A* with landmark lower bounds from the start node to the goal node
+    # profile picks the weighting (a name from weight_profiles.PROFILES, None = the default)
+    # Returns (path_list, total_cost), or ([goal], float('inf')) if the goal is unreachable
+    csr = as_csr(graph)
+    if start not in csr.index or goal not in csr.index:
+        return [goal], INF
+
+    s = csr.index[start]
+    t = csr.index[goal]
+    if s == t:
+        return [start], 0.0
+
+    marks = landmarks(csr, profile=profile)
+    weights = edge_weights(csr, profile)
+    reverse_offsets, reverse_sources, reverse_edges = csr.reverse
+
+    # Average potential: p(v) = (bound(v -> t) - bound(s -> v)) / 2
+    # The forward search uses p, the backward search -p; both give non-negative reduced costs
+    potentials = {}
+
+    def potential(v):
+        p = potentials.get(v)
+        if p is None:
+            p = potentials[v] = (marks.lower_bound(v, t) - marks.lower_bound(s, v)) / 2.0
+        return p
+
+    forward_costs, backward_costs = {s: 0.0}, {t: 0.0}
+    forward_parent, backward_parent = {s: -1}, {t: -1}
+    forward_heap = [(potential(s), s)]
+    backward_heap = [(-potential(t), t)]
+    forward_done, backward_done = set(), set()
+    best = INF
+    meeting = -1
+
+    while forward_heap and backward_heap:
+        # Every path not found yet costs at least the sum of the two smallest keys
+        if forward_heap[0][0] + backward_heap[0][0] >= best:
+            break
+
+        if forward_heap[0][0] <= backward_heap[0][0]:
+            _, node = heapq.heappop(forward_heap)
+            if node in forward_done:
+                continue
+            forward_done.add(node)
+            cost = forward_costs[node]
+            for e in range(csr.offsets[node], csr.offsets[node + 1]):
+                neighbor = csr.targets[e]
+                new_cost = cost + weights[e]
+                if new_cost < forward_costs.get(neighbor, INF):
+                    forward_costs[neighbor] = new_cost
+                    forward_parent[neighbor] = node
+                    heapq.heappush(forward_heap, (new_cost + potential(neighbor), neighbor))
+                    if neighbor in backward_costs and new_cost + backward_costs[neighbor] < best:
+                        best = new_cost + backward_costs[neighbor]
+                        meeting = neighbor
+        else:
+            _, node = heapq.heappop(backward_heap)
+            if node in backward_done:
+                continue
+            backward_done.add(node)
+            cost = backward_costs[node]
+            for i in range(reverse_offsets[node], reverse_offsets[node + 1]):
+                neighbor = reverse_sources[i]
+                new_cost = cost + weights[reverse_edges[i]]
+                if new_cost < backward_costs.get(neighbor, INF):
+                    backward_costs[neighbor] = new_cost
+                    backward_parent[neighbor] = node
+                    heapq.heappush(backward_heap, (new_cost - potential(neighbor), neighbor))
+                    if neighbor in forward_costs and new_cost + forward_costs[neighbor] < best:
+                        best = new_cost + forward_costs[neighbor]
+                        meeting = neighbor
+
+    if meeting == -1:
+        return [goal], INF
+
+    path = []
+    node = meeting
+    while node != -1:
+        path.append(node)
+        node = forward_parent[node]
+    path.reverse()
+    node = backward_parent[meeting]
+    while node != -1:
+        path.append(node)
+        node = backward_parent[node]
+    return csr.path_ids(path), best
@@ -1,41 +1,36 @@
-from create_nodes import open_images
-from create_nodes import parse_metadata
-from create_graph import create_graph
+from graph_snapshot import load_graph, DEFAULT_MODEL_PATH, DEFAULT_SNAPSHOT_PATH
 from dijkstra_search import Dijkstra
 from a_star_search import A_star
-from coordinate_conversion import dms_to_decimal
-import cv2
-import math, time, argparse
+from route_matrix import route_matrix, batch_routes
+from contraction_hierarchy import CH_search, contraction_hierarchy
+from landmarks import ALT_search, landmarks
+from pareto_search import pareto_search, DEFAULT_MAX_LABELS, DEFAULT_MAX_ROUTES
+from alternative_routes import alternative_routes
+from isochrone import isochrone
+from search_trace import SearchTrace
+from csr_graph import as_csr
+from weight_profiles import PROFILES, edge_weights, profile_name
+import os, sys, time, argparse, csv, json, math
 
 
-def distance(a, b):
-    R = 6371000.0
-    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
-    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
-    dlat, dlon = lat2 - lat1, lon2 - lon1
-    sa = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    return 2 * R * math.asin(math.sqrt(sa))
+def find_nearest_node(coord, graph):
+    # Snaps a coordinate to the closest node using the graph's spatial index
+    found = graph.nearest(coord, k=1)
+    if not found:
+        return None
+    node_id, _ = found[0]
+    return graph.nodes[node_id]
 
 
-def find_nearest_node(coord, nodes):
-    best = None
-    best_d = float('inf')
-    for n in nodes.values():
-        d = distance(coord, n.coordinate)
-        if d < best_d:
-            best_d = d
-            best = n
-    return best
-
-
-def build_graph_and_nodes():
-    images = open_images()
-    nodes = parse_metadata(images)
-    for node in nodes.values():
-        node.coordinate = dms_to_decimal(node.coordinate)
-    graph = create_graph()
-    graph.build_graph(nodes)
-    return graph, nodes
+def build_graph_and_nodes(rebuild=False, routing_only=False, model_path=DEFAULT_MODEL_PATH):
+    # Loads the compiled graph snapshot when it is up to date, otherwise builds the graph
+    # (images + AI scoring with the model at model_path, .pt or .onnx) and compiles a new
+    # snapshot. rebuild=True always recompiles.
+    # routing_only=True builds from the cached scores without loading the AI model
+    if rebuild and os.path.exists(DEFAULT_SNAPSHOT_PATH):
+        os.remove(DEFAULT_SNAPSHOT_PATH)
+    graph = load_graph(model_path, routing_only=routing_only)
+    return graph, graph.nodes
 
 
 def parse_coord_or_id(value):
@@ -47,45 +42,228 @@ def parse_coord_or_id(value):
             return value
     return value
 
+
+def resolve_node(value, graph, nodes):
+    # Turns a node id or 'lat,lon' string into a node (None if it can't be found)
+    value = parse_coord_or_id(value)
+    if isinstance(value, (list, tuple)):
+        return find_nearest_node(value, graph)
+    return nodes.get(value)
+
+
+def print_matrix(graph, nodes, points, workers=None):
+    # Prints the cost between every pair of the given points (node ids or 'lat,lon')
+    resolved = [resolve_node(p, graph, nodes) for p in points]
+    if any(node is None for node in resolved):
+        print('Invalid point; check node IDs or coordinate format lat,lon')
+        return
+
+    ids = [node.id for node in resolved]
+    t0 = time.time()
+    matrix = route_matrix(graph, ids, workers=workers)
+    t1 = time.time()
+
+    width = max(8, max(len(node_id) for node_id in ids) + 1)
+    print('Cost matrix (safety-weighted, rows = from, columns = to)')
+    print(' ' * width + ''.join(f'{node_id:>{width + 2}}' for node_id in ids))
+    for node_id, row in zip(ids, matrix['cost']):
+        print(f'{node_id:<{width}}' + ''.join(f'{cost:>{width + 2}.1f}' for cost in row))
+    print(f'Time: {t1 - t0:.6f}s for {len(ids) * len(ids)} routes')
+
+def print_pareto(graph, start_id, end_id, max_routes, max_labels=DEFAULT_MAX_LABELS):
+    # Prints the routes from the shortest to the safest (see pareto_search.py)
+    t0 = time.time()
+    routes, complete = pareto_search(graph, start_id, end_id, max_routes=max_routes, max_labels=max_labels)
+    t1 = time.time()
+    if not routes:
+        print('No route found')
+        return
+    for number, (path, distance, exposure) in enumerate(routes, 1):
+        print(f'Route {number}: {distance:.0f} m, {exposure:.0f} m of hazard exposure')
+        print('  Path:', path)
+    if not complete:
+        print('The search stopped at its label limit; routes between the shortest and the safest may be missing')
+    print(f'Time: {t1 - t0:.6f}s')
+
+def print_alternatives(graph, start_id, end_id, alternatives, weights):
+    # Prints the best route and up to `alternatives` different ones (see alternative_routes.py)
+    t0 = time.time()
+    routes = alternative_routes(graph, start_id, end_id, alternatives=alternatives, weights=weights)
+    t1 = time.time()
+    if not routes:
+        print('No route found')
+        return
+    for number, (path, cost, length, overlap) in enumerate(routes, 1):
+        print(f'Route {number}: cost {cost:.2f}, {length:.0f} m, {overlap:.0%} shared with route 1')
+        print('  Path:', path)
+    print(f'Time: {t1 - t0:.6f}s')
+
+def print_isochrone(graph, source_id, budget, weights):
+    # Prints every node reachable from the source within the budget (see isochrone.py)
+    t0 = time.time()
+    result = isochrone(graph, source_id, budget, weights=weights, hull=True)
+    t1 = time.time()
+    print(f'Reachable within {budget:g}: {len(result["nodes"])} nodes')
+    for node_id, cost, length in result['nodes']:
+        print(f'  {node_id:<8} cost {cost:10.2f}  {length:8.0f} m')
+    print('Outline:', [(round(lat, 6), round(lon, 6)) for lat, lon in result['hull']])
+    print(f'Time: {t1 - t0:.6f}s')
+
+def run_batch(graph, nodes, csv_path):
+    # Routes every row of a CSV file with 'start' and 'end' columns (node ids or quoted 'lat,lon')
+    # and prints one JSON line per row, in the same format as the website's /routes/batch
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    pairs = []
+    positions = []
+    for index, row in enumerate(rows):
+        start_node = resolve_node(row.get('start'), graph, nodes)
+        end_node = resolve_node(row.get('end'), graph, nodes)
+        if start_node is None or end_node is None:
+            print(json.dumps({'index': index, 'error': 'Invalid start or end'}))
+        else:
+            pairs.append((start_node.id, end_node.id))
+            positions.append(index)
+
+    t0 = time.time()
+    for position, node_path, cost, _ in batch_routes(graph, pairs):
+        start_id, end_id = pairs[position]
+        unreachable = not math.isfinite(cost)
+        print(json.dumps({
+            'index': positions[position],
+            'start': start_id,
+            'end': end_id,
+            'path': [nodes[nid].coordinate for nid in node_path],
+            'node_path': node_path,
+            'distance_m': None if unreachable else cost,
+            'unreachable': unreachable
+        }))
+    t1 = time.time()
+    origins = len({start for start, _ in pairs})
+    print(f'Time: {t1 - t0:.6f}s for {len(pairs)} routes from {origins} origins', file=sys.stderr)
+
 def main():
     parser = argparse.ArgumentParser(description="Run pathfinding between two nodes or coords")
     parser.add_argument('--start', '-s', help="Start node id or 'lat,lon'", default='h1')
     parser.add_argument('--end', '-e', help="End node id or 'lat,lon'", default='s25')
-    parser.add_argument('--algo', choices=['astar', 'dijkstra'], default='astar')
+    parser.add_argument('--algo', choices=['astar', 'dijkstra', 'ch', 'alt', 'pareto'], default='astar',
+                        help="pareto prints the routes from the shortest to the safest")
+    parser.add_argument('--max-routes', type=int, default=DEFAULT_MAX_ROUTES,
+                        help="Most routes printed by --algo pareto")
+    parser.add_argument('--max-labels', type=int, default=DEFAULT_MAX_LABELS,
+                        help="Labels --algo pareto expands before it stops (bounds its running time)")
+    parser.add_argument('--isochrone', type=float, metavar='BUDGET',
+                        help="Print every node reachable from --start within this cost, and their outline")
+    parser.add_argument('--alternatives', type=int, default=0, metavar='N',
+                        help="Also print up to N different routes (astar and dijkstra)")
+    parser.add_argument('--profile', default='balanced',
+                        help=f"Weighting: {', '.join(PROFILES)} or a custom penalty factor (default: balanced)")
+    parser.add_argument('--as-of-year', type=int, default=None,
+                        help="Weigh the roads by the photos taken up to this year (astar and dijkstra)")
+    parser.add_argument('--trace', action='store_true',
+                        help="Print what the search did (nodes popped, edges relaxed, time per phase)")
+    parser.add_argument('--rebuild', action='store_true', help="Ignore the graph snapshot and rebuild it")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH,
+                        help="Hazard classifier weights, .pt (ultralytics) or .onnx (onnxruntime)")
+    parser.add_argument('--routing-only', action='store_true',
+                        help="Never load the AI model; a rebuild takes the safety scores from the score cache")
+    parser.add_argument('--matrix', nargs='+', metavar='POINT',
+                        help="Print the cost between every pair of these node ids / 'lat,lon' points")
+    parser.add_argument('--batch', metavar='FILE.csv',
+                        help="Route every start,end row of a CSV file and print JSON lines")
+    parser.add_argument('--workers', type=int, default=None, help="Processes used by --matrix (default: one per core)")
     args = parser.parse_args()
 
-    graph, nodes = build_graph_and_nodes()
+    graph, nodes = build_graph_and_nodes(rebuild=args.rebuild, routing_only=args.routing_only, model_path=args.model)
 
-    start_val = parse_coord_or_id(args.start)
-    end_val = parse_coord_or_id(args.end)
+    if args.matrix:
+        print_matrix(graph, nodes, args.matrix, args.workers)
+        return
 
-    if isinstance(start_val, (list, tuple)):
-        start_node = find_nearest_node(start_val, nodes)
-    else:
-        start_node = nodes.get(start_val)
+    if args.batch:
+        run_batch(graph, nodes, args.batch)
+        return
 
-    if isinstance(end_val, (list, tuple)):
-        end_node = find_nearest_node(end_val, nodes)
-    else:
-        end_node = nodes.get(end_val)
+    start_node = resolve_node(args.start, graph, nodes)
+    end_node = resolve_node(args.end, graph, nodes)
 
     if start_node is None or end_node is None:
         print('Invalid start or end; check node IDs or coordinate format lat,lon')
         return
 
+    try:
+        profile = profile_name(args.profile)
+    except ValueError as e:
+        print(e)
+        return
+    if args.algo in ('ch', 'alt') and profile not in PROFILES:
+        print(f"--algo {args.algo} needs one of the profiles {', '.join(PROFILES)}")
+        return
+
     print(f"Start: {start_node.id} @ {start_node.coordinate}")
     print(f"End:   {end_node.id} @ {end_node.coordinate}")
 
+    if args.algo == 'pareto':
+        print_pareto(graph, start_node.id, end_node.id, args.max_routes, args.max_labels)
+        return
+
+    if args.algo == 'ch':
+        # Preprocessing (or loading it from the cache) is not part of the query time
+        t0 = time.time()
+        contraction_hierarchy(graph, profile=profile)
+        print(f'Contraction hierarchy ready in {time.time() - t0:.3f}s')
+    elif args.algo == 'alt':
+        t0 = time.time()
+        landmarks(graph, profile=profile)
+        print(f'Landmarks ready in {time.time() - t0:.3f}s')
+
+    trace = SearchTrace() if args.trace else None
+    if trace is not None and args.algo not in ('astar', 'dijkstra'):
+        print('--trace is only available for astar and dijkstra')
+        trace = None
+
+    if args.as_of_year is not None:
+        if args.algo not in ('astar', 'dijkstra'):
+            print('--as-of-year is only available for astar and dijkstra')
+            return
+        if as_csr(graph).hazard_profiles is None:
+            print('--as-of-year needs dated images, the graph has none')
+            return
+    weights = edge_weights(graph, profile, args.as_of_year)
+
+    if args.isochrone is not None:
+        if args.isochrone < 0:
+            print('--isochrone needs a budget of 0 or more')
+            return
+        print_isochrone(graph, start_node.id, args.isochrone, weights)
+        return
+
+    if args.alternatives > 0:
+        if args.algo not in ('astar', 'dijkstra'):
+            print('--alternatives is only available for astar and dijkstra')
+            return
+        print_alternatives(graph, start_node.id, end_node.id, args.alternatives, weights)
+        return
+
     t0 = time.time()
     if args.algo == 'dijkstra':
-        node_path, total_distance = Dijkstra(graph, start_node_id=start_node.id, end_node_id=end_node.id)
+        node_path, total_distance = Dijkstra(graph, start_node_id=start_node.id, end_node_id=end_node.id, trace=trace,
+                                             weights=weights)
+    elif args.algo == 'ch':
+        node_path, total_distance = CH_search(graph, start_node.id, end_node.id, profile=profile)
+    elif args.algo == 'alt':
+        node_path, total_distance = ALT_search(graph, start_node.id, end_node.id, profile=profile)
     else:
-        node_path, total_distance = A_star(graph, start_node.id, end_node.id)
+        node_path, total_distance = A_star(graph, start_node.id, end_node.id, trace=trace, weights=weights)
     t1 = time.time()
 
+    print('Profile:', profile)
     print('Path:', node_path)
     print(f'Total distance: {total_distance:.2f} (units as in metadata)')
     print(f'Time: {t1 - t0:.6f}s')
+    if trace is not None:
+        print('Trace:', trace)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
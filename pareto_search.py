@@ -0,0 +1,214 @@
+# This file finds the trade-off between the shortest and the safest route in one search.
+# Every path is measured twice: its real distance (metres) and its hazard exposure, the sum of
+# distance * safety_score over its edges (metres driven on hazardous road). A path is on the
+# Pareto front when no other path is at least as short and at least as safe, and better in one.
+#
+# The search is a multi-criteria Dijkstra (label setting): every node keeps a "bag" of labels,
+# one per non-dominated (distance, exposure) pair found so far. Labels are expanded in order of
+# distance; a new label is dropped when a label already at that node, or a route already
+# found to the goal, is at least as good in both criteria, and it removes the labels it beats.
+# Labels that reach the goal are final, so the front comes out sorted from shortest to safest.
+#
+# Before the label search, two reverse Dijkstra trees into the goal (one over distance, one
+# over exposure) give the two ends of the front, the shortest and the safest route, plus for
+# every node the least distance and the least exposure still needed to reach the goal. The two
+# routes seed the goal's bag, and a label is dropped as soon as its totals plus those lower
+# bounds are beaten by a route in that bag, which cuts most of the search away.
+#
+# The number of labels can grow quickly on large graphs, so the search stops after max_labels
+# expansions (and says so), and at most max_routes routes are returned. A search that stops
+# early still returns the shortest and the safest route, with whatever it found in between.
+
+import heapq
+from array import array
+
+import numpy as np
+
+from csr_graph import as_csr
+from dijkstra_search import reverse_shortest_path_tree
+
+DEFAULT_MAX_ROUTES = 5
+DEFAULT_MAX_LABELS = 200000
+
+
+def _dominated(bag, distance, exposure, label_distance, label_exposure):
+    # True if a label in bag is at least as good as (distance, exposure) in both criteria
+    for label in bag:
+        if label_distance[label] <= distance and label_exposure[label] <= exposure:
+            return True
+    return False
+
+
+def exposure_weights(graph):
+    # distance * safety_score of every edge (kept in csr.derived until the scores change)
+    csr = as_csr(graph)
+    weights = csr.derived.get(('exposure',))
+    if weights is None:
+        values = np.asarray(csr.distance, dtype=np.float64) * np.asarray(csr.safety_score, dtype=np.float64)
+        weights = array('d', values.tobytes())
+        csr.derived[('exposure',)] = weights
+    return weights
+
+
+def _tree_route(csr, start, following, exposures):
+    # Node indexes of the tree route from start to the goal and its (distance, exposure)
+    path = [start]
+    distance = exposure = 0.0
+    while following[path[-1]] != -1:
+        u, w = path[-1], following[path[-1]]
+        # One edge per (u, w) pair (see CSRBuilder)
+        for e in range(csr.offsets[u], csr.offsets[u + 1]):
+            if csr.targets[e] == w:
+                distance += csr.distance[e]
+                exposure += exposures[e]
+                break
+        path.append(w)
+    return path, distance, exposure
+
+
+def _thin(front, count):
+    # Keeps count routes spread evenly over the front, always the shortest and the safest
+    if len(front) <= count:
+        return front
+    if count == 1:
+        return front[:1]
+    step = (len(front) - 1) / (count - 1)
+    return [front[round(i * step)] for i in range(count)]
+
+
+def pareto_search(graph, start, goal, max_routes=DEFAULT_MAX_ROUTES, max_labels=DEFAULT_MAX_LABELS):
+    """
+    Finds the Pareto front of routes between two nodes over (distance, hazard exposure).
+
+    Args:
+        graph: The built graph (create_graph or CSRGraph).
+        start, goal (str): Node ids.
+        max_routes (int): Most routes returned, spread evenly from the shortest to the safest.
+        max_labels (int): Labels expanded before the search gives up; the shortest and the
+                          safest route and the routes found between them up to then are
+                          returned.
+
+    Returns:
+        tuple: (routes, complete). routes is a list of (path_list, distance, exposure) from the
+        shortest to the safest, empty only if the goal is unreachable. complete is False when
+        the search stopped at max_labels (routes between the two ends may be missing).
+    """
+    csr = as_csr(graph)
+    if start not in csr.index or goal not in csr.index:
+        return [], True
+
+    start_index = csr.index[start]
+    goal_index = csr.index[goal]
+    if start_index == goal_index:
+        return [([start], 0.0, 0.0)], True
+    offsets, targets = csr.offsets, csr.targets
+    distances = csr.distance
+    exposures = exposure_weights(csr)
+
+    # Least distance and least exposure from every node to the goal, and the two end routes
+    to_goal_distance, _, shortest_next = reverse_shortest_path_tree(csr, goal, weights=distances)
+    if to_goal_distance[start_index] == float('inf'):
+        return [], True
+    to_goal_exposure, _, safest_next = reverse_shortest_path_tree(csr, goal, weights=exposures)
+
+    # Labels are stored column-wise; a label is (distance, exposure, node, parent label)
+    label_distance = [0.0]
+    label_exposure = [0.0]
+    label_node = [start_index]
+    label_parent = [-1]
+    alive = [True]
+
+    # The shortest and safest routes are goal labels from the start, with their paths kept aside.
+    # They are never expanded; a route found by the search that beats one of them replaces it
+    seeds = {}
+    goal_bag = []
+    for following in (shortest_next, safest_next):
+        path, distance, exposure = _tree_route(csr, start_index, following, exposures)
+        if _dominated(goal_bag, distance, exposure, label_distance, label_exposure):
+            continue
+        seed = len(label_node)
+        label_distance.append(distance)
+        label_exposure.append(exposure)
+        label_node.append(goal_index)
+        label_parent.append(-1)
+        alive.append(True)
+        seeds[seed] = path
+        goal_bag.append(seed)
+
+    bags = {start_index: [0], goal_index: goal_bag}
+    front = []
+    heap = [(0.0, 0.0, 0)]
+    expanded = 0
+    complete = True
+
+    while heap:
+        distance, exposure, label = heapq.heappop(heap)
+        if not alive[label]:
+            # Beaten by a label found after it was pushed
+            continue
+        node = label_node[label]
+        if node == goal_index:
+            front.append(label)
+            continue
+
+        expanded += 1
+        if expanded > max_labels:
+            complete = False
+            break
+
+        goal_bag = bags.get(goal_index, ())
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbor = targets[e]
+            bound_distance = to_goal_distance[neighbor]
+            if bound_distance == float('inf'):
+                continue
+            new_distance = distance + distances[e]
+            new_exposure = exposure + exposures[e]
+
+            # A route to the goal that is already as good as the best this label can still
+            # become makes any extension pointless
+            if _dominated(goal_bag, new_distance + bound_distance, new_exposure + to_goal_exposure[neighbor],
+                          label_distance, label_exposure):
+                continue
+            bag = bags.get(neighbor)
+            if bag is None:
+                bag = bags[neighbor] = []
+            elif _dominated(bag, new_distance, new_exposure, label_distance, label_exposure):
+                continue
+
+            kept = []
+            for other in bag:
+                if new_distance <= label_distance[other] and new_exposure <= label_exposure[other]:
+                    alive[other] = False
+                else:
+                    kept.append(other)
+            new_label = len(label_node)
+            kept.append(new_label)
+            bags[neighbor] = kept
+            if neighbor == goal_index:
+                goal_bag = kept
+
+            label_distance.append(new_distance)
+            label_exposure.append(new_exposure)
+            label_node.append(neighbor)
+            label_parent.append(label)
+            alive.append(True)
+            heapq.heappush(heap, (new_distance, new_exposure, new_label))
+
+    # Seeds no route beat are on the front too (the search never pops them)
+    front.extend(seed for seed in seeds if alive[seed])
+    front.sort(key=lambda label: (label_distance[label], label_exposure[label]))
+
+    routes = []
+    for label in _thin(front, max_routes):
+        if label in seeds:
+            path = seeds[label]
+        else:
+            path = []
+            current = label
+            while current != -1:
+                path.append(label_node[current])
+                current = label_parent[current]
+            path.reverse()
+        routes.append((csr.path_ids(path), label_distance[label], label_exposure[label]))
+    return routes, complete
@@ -0,0 +1,71 @@
+# This file keeps the results of recent route searches in memory so that repeated requests
+# (popular intersections, map clicks snapped to the same node) are a dictionary lookup.
+# Results are only valid for the edge weights they were computed with, so every entry belongs
+# to a graph version (CSRGraph.version, bumped whenever weights are patched) and a lookup with
+# a newer version misses. Results that only depend on the distances (the shortest profile) are
+# stored with version None and stay valid however the safety scores change.
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ROUTES = 10000
+
+
+class RouteCache:
+    """
+    Bounded LRU of route results keyed by (start node, end node, algorithm, weighting profile,
+    as-of year).
+
+    Attributes:
+        max_entries (int): How many routes are kept before the least recently used is dropped.
+        hits, misses (int): Lookup counters.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ROUTES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        # Returns the stored result for key, or None if there is none for this graph version
+        # (version None: a result that holds for every version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    # Computed before the weights changed
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, result):
+        # version is the one read before the search; if the weights changed while searching,
+        # the entry is already older than the graph and the next get drops it
+        with self._lock:
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,140 @@
+# This file computes travel costs between many points at once (e.g. every repair crew depot
+# to every reported hazard, or a fleet planner's list of trips). Instead of one A* search per pair, it grows one shortest path tree
+# per origin (dijkstra_search.shortest_path_tree) and reads every destination off that tree.
+# Large matrices are spread over a pool of processes. The pool is forked after the graph is
+# loaded, so every worker reads the same graph memory without copying or pickling it.
+# Forking a process that runs threads (e.g. the web server) is unsafe, so servers call this
+# with workers=1 and compute the matrix in the calling thread.
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from csr_graph import as_csr
+from dijkstra_search import shortest_path_tree, tree_path
+
+# Below this much work (origins x edges) a process pool costs more than it saves
+PARALLEL_MIN_WORK = 200_000
+
+# The graph and destination indexes of a forked worker, set by _init_worker in the worker
+# process only (the caller's globals are never touched, so concurrent calls can't mix)
+_worker_graph = None
+_worker_destinations = None
+
+
+def _matrix_row(csr, destinations, origin_id):
+    costs, lengths, _ = shortest_path_tree(csr, origin_id)
+    return ([costs[i] for i in destinations],
+            [lengths[i] for i in destinations])
+
+
+def _init_worker(csr, destinations):
+    # Runs once in every worker. With fork the arguments are inherited, not pickled
+    global _worker_graph, _worker_destinations
+    _worker_graph = csr
+    _worker_destinations = destinations
+
+
+def _worker_row(origin_id):
+    return _matrix_row(_worker_graph, _worker_destinations, origin_id)
+
+
+def route_matrix(graph, origins, destinations=None, workers=None):
+    """
+    Computes the cost of the best route between every origin and every destination.
+
+    Args:
+        graph: The built graph.
+        origins (list): Node ids the routes start from.
+        destinations (list): Node ids the routes end at (defaults to the origins).
+        workers (int): Processes to use. Defaults to one per core; 1 runs everything in this
+                       process (and thread). Small matrices always run in this process.
+                       Multithreaded callers (the web server) must pass 1, since forking a
+                       process with running threads can deadlock the workers.
+
+    Returns:
+        dict: 'origins' and 'destinations' (the node ids), 'cost' (safety-weighted cost, the
+              same value /route reports) and 'distance_m' (real metres along that route),
+              both as lists of rows, one row per origin. Unreachable pairs are inf.
+    """
+    csr = as_csr(graph)
+    origins = list(origins)
+    destinations = list(origins if destinations is None else destinations)
+    for node_id in origins + destinations:
+        if node_id not in csr.index:
+            raise KeyError(f"Unknown node id: {node_id}")
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(origins))
+    parallel = (workers > 1
+                and len(origins) * max(csr.edge_count, 1) >= PARALLEL_MIN_WORK
+                and 'fork' in multiprocessing.get_all_start_methods())
+
+    destination_indexes = [csr.index[node_id] for node_id in destinations]
+    if parallel:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(csr, destination_indexes)) as pool:
+            chunksize = max(1, len(origins) // (workers * 4))
+            rows = list(pool.map(_worker_row, origins, chunksize=chunksize))
+    else:
+        rows = [_matrix_row(csr, destination_indexes, origin_id) for origin_id in origins]
+
+    return {
+        'origins': origins,
+        'destinations': destinations,
+        'cost': [cost_row for cost_row, _ in rows],
+        'distance_m': [length_row for _, length_row in rows]
+    }
+
+
+def batch_routes(graph, pairs):
+    """
+    Finds the route for many (start, end) pairs, growing one shortest path tree per distinct
+    start node (stopped once all of that start's ends are reached) instead of one search per pair.
+
+    Args:
+        graph: The built graph.
+        pairs (list): (start node id, end node id) tuples.
+
+    Yields:
+        tuple: (position in pairs, node_path, cost, distance_m) for every pair, grouped by
+               start node. Unreachable pairs give ([end], inf, inf) like the searches.
+    """
+    csr = as_csr(graph)
+    for start, queries in group_by_start(csr, pairs).items():
+        yield from start_routes(csr, start, queries)
+
+
+def group_by_start(graph, pairs):
+    """
+    Groups (start, end) pairs by start node for start_routes.
+    Returns a dict of start node id -> [(position in pairs, end node id), ...] in the order
+    the starts first appear. Raises KeyError for unknown node ids.
+    """
+    csr = as_csr(graph)
+    by_start = {}
+    for position, (start, end) in enumerate(pairs):
+        for node_id in (start, end):
+            if node_id not in csr.index:
+                raise KeyError(f"Unknown node id: {node_id}")
+        by_start.setdefault(start, []).append((position, end))
+    return by_start
+
+
+def start_routes(graph, start, queries):
+    """
+    Answers all queries of one start node from a single shortest path tree, stopped once
+    every end is reached. queries is a list of (position, end node id) as made by
+    group_by_start. Returns a list of (position, node_path, cost, distance_m) like batch_routes.
+    """
+    csr = as_csr(graph)
+    costs, lengths, previous = shortest_path_tree(csr, start, {end for _, end in queries})
+    routes = []
+    for position, end in queries:
+        i = csr.index[end]
+        if costs[i] == float('inf'):
+            routes.append((position, [end], costs[i], lengths[i]))
+        else:
+            routes.append((position, tree_path(csr, previous, end), costs[i], lengths[i]))
+    return routes
@@ -0,0 +1,144 @@
+# This file keeps the hazard scores produced by the AI model on disk so that an image only
+# ever has to go through the network once.
+# Every entry is keyed by the content hash of the image AND the hash of the model weights,
+# so retraining the model (new best.pt) simply stops matching the old entries while every
+# entry made with the current weights stays valid. The weights hash also covers
+# PREPROCESS_VERSION, so changing how frames are prepared for the network retires old entries too.
+
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+directory = os.path.dirname(__file__)
+DEFAULT_CACHE_PATH = os.path.join(directory, 'cache', 'hazard_scores.sqlite')
+
+# Bump whenever RoadScanner._preprocess (or the decoding before it) changes the pixels the
+# network sees, since the scores change with them
+PREPROCESS_VERSION = 2
+
+# SQLite limits how many "?" parameters one statement may have, so lookups are chunked
+QUERY_CHUNK = 500
+
+
+def file_digest(path):
+    """
+    Returns the SHA-1 hex digest of a file's bytes (used to fingerprint the model weights).
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def model_digest(path):
+    """
+    Returns the fingerprint that cached scores and snapshots are keyed by: the SHA-1 of the
+    weights file combined with PREPROCESS_VERSION (still a 40 character hex digest).
+    """
+    return hashlib.sha1(f'{file_digest(path)}:{PREPROCESS_VERSION}'.encode('ascii')).hexdigest()
+
+
+def image_digest(image):
+    """
+    Returns a short hex string that identifies an image by its content (the cache key).
+    Two arrays with the same shape and pixels always give the same digest.
+    Lazy handles are identified by the hash of their file, so they never need decoding.
+    """
+    if not isinstance(image, np.ndarray):
+        return image.digest
+    h = hashlib.sha1(str(image.shape).encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class HazardScoreCache:
+    """
+    A small SQLite table of (image hash, weights hash) -> hazard report.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        """
+        Opens (or creates) the cache file.
+
+        Args:
+            path (str): Where the SQLite file lives. ':memory:' gives a throwaway cache.
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " image_hash TEXT NOT NULL,"
+            " weights_hash TEXT NOT NULL,"
+            " hazard_score REAL NOT NULL,"
+            " is_hazardous INTEGER NOT NULL,"
+            " prediction TEXT NOT NULL,"
+            " PRIMARY KEY (image_hash, weights_hash)"
+            ") WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    def get_many(self, image_hashes, weights_hash):
+        """
+        Looks up the stored reports for many images at once.
+
+        Args:
+            image_hashes (list): Content hashes of the images.
+            weights_hash (str): Hash of the model weights the reports must come from.
+
+        Returns:
+            dict: image_hash -> report (same format as RoadScanner.scan_image) for every hit.
+        """
+        image_hashes = list(image_hashes)
+        found = {}
+        for start in range(0, len(image_hashes), QUERY_CHUNK):
+            chunk = image_hashes[start:start + QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                "SELECT image_hash, hazard_score, is_hazardous, prediction FROM scores"
+                f" WHERE weights_hash = ? AND image_hash IN ({placeholders})",
+                [weights_hash, *chunk]
+            )
+            for image_hash, hazard_score, is_hazardous, prediction in rows:
+                found[image_hash] = {
+                    "is_hazardous": bool(is_hazardous),
+                    "hazard_score": hazard_score,
+                    "prediction": prediction
+                }
+        return found
+
+    def put_many(self, reports, weights_hash):
+        """
+        Stores new reports.
+
+        Args:
+            reports (dict): image_hash -> report (as returned by RoadScanner.scan_image).
+            weights_hash (str): Hash of the model weights that produced the reports.
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+            [
+                (image_hash, weights_hash, report['hazard_score'],
+                 int(report['is_hazardous']), report['prediction'])
+                for image_hash, report in reports.items()
+            ]
+        )
+        self.connection.commit()
+
+    def prune(self, weights_hash):
+        """
+        Deletes every entry that was made with different model weights.
+        Returns the number of entries removed.
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM scores WHERE weights_hash != ?", (weights_hash,)
+        )
+        self.connection.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.connection.close()
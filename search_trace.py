@@ -0,0 +1,58 @@
+# This file holds the optional profiling record the searches fill in (A_star and Dijkstra take
+# trace=SearchTrace()). Without a trace the searches run a loop with no counters at all and
+# never touch the clock, so normal requests pay nothing for it.
+
+import time
+
+
+class SearchTrace:
+    """
+    What one search did.
+
+    Attributes:
+        nodes_popped (int): Heap entries taken off the queue (including stale ones).
+        edges_relaxed (int): Edges looked at from expanded nodes.
+        heap_pushes (int): Entries pushed on the queue (including the start).
+        stale_pops (int): Popped entries skipped because a cheaper path was already known.
+        phases (dict): Wall time in seconds per phase name, in the order they ran.
+    """
+
+    def __init__(self):
+        self.nodes_popped = 0
+        self.edges_relaxed = 0
+        self.heap_pushes = 0
+        self.stale_pops = 0
+        self.phases = {}
+        self._last = None
+
+    def start(self):
+        # Starts the clock for the first phase
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        # Ends the current phase, charging the time since the last mark (or start) to it
+        now = time.perf_counter()
+        if self._last is not None:
+            self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def count(self, nodes_popped=0, edges_relaxed=0, heap_pushes=0, stale_pops=0):
+        self.nodes_popped += nodes_popped
+        self.edges_relaxed += edges_relaxed
+        self.heap_pushes += heap_pushes
+        self.stale_pops += stale_pops
+
+    def as_dict(self):
+        return {
+            'nodes_popped': self.nodes_popped,
+            'edges_relaxed': self.edges_relaxed,
+            'heap_pushes': self.heap_pushes,
+            'stale_pops': self.stale_pops,
+            'phases_s': dict(self.phases),
+            'total_s': sum(self.phases.values())
+        }
+
+    def __str__(self):
+        phases = ', '.join(f'{name} {seconds * 1000:.3f}ms' for name, seconds in self.phases.items())
+        return (f'popped {self.nodes_popped} (stale {self.stale_pops}), relaxed {self.edges_relaxed} edges, '
+                f'{self.heap_pushes} heap pushes | {phases}')
@@ -0,0 +1,137 @@
+# This file finds the graph nodes closest to a coordinate (e.g. a map click) without looking at
+# every node. The nodes are placed on a unit sphere (x, y, z) and stored in a KD-tree, so a
+# lookup only visits O(log n) nodes. Straight-line (chord) distances on the sphere sort in the
+# same order as great-circle distances, and are converted back to metres for the results.
+
+import heapq
+import math
+
+import numpy as np
+
+from geodesic import EARTH_RADIUS_M
+
+LEAF_SIZE = 8
+
+
+def to_unit_sphere(latitude, longitude):
+    # Returns (x, y, z) of a coordinate given in decimal degrees
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_metres(chord):
+    return 2.0 * EARTH_RADIUS_M * math.asin(min(1.0, chord / 2.0))
+
+
+def metres_to_chord(metres):
+    return 2.0 * math.sin(min(math.pi, metres / EARTH_RADIUS_M) / 2.0)
+
+
+class SpatialIndex:
+    """
+    KD-tree over the nodes of a graph.
+
+    The tree is implicit: the points are reordered so that the middle point of every range
+    is the splitting point of that range, and points left/right of it fall on either side.
+    """
+
+    def __init__(self, latitude, longitude):
+        """
+        Args:
+            latitude, longitude: Decimal coordinates per node index. Nodes with a NaN
+                                 coordinate are left out of the index.
+        """
+        lat = np.radians(np.asarray(latitude, dtype=np.float64))
+        lon = np.radians(np.asarray(longitude, dtype=np.float64))
+        valid = np.nonzero(~(np.isnan(lat) | np.isnan(lon)))[0]
+        lat, lon = lat[valid], lon[valid]
+        points = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+        count = len(valid)
+        order = np.arange(count)
+        axes = np.zeros(count, dtype=np.int8)
+
+        # Split every range at its median along the axis where the points are most spread out
+        stack = [(0, count)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            mid = (lo + hi) // 2
+            block = order[lo:hi]
+            axis = int(np.argmax(np.ptp(points[block], axis=0)))
+            order[lo:hi] = block[np.argpartition(points[block, axis], mid - lo)]
+            axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+        # Plain lists are much faster than numpy arrays for the scalar lookups of a query
+        ordered = points[order]
+        self._coords = (ordered[:, 0].tolist(), ordered[:, 1].tolist(), ordered[:, 2].tolist())
+        self._node = valid[order].tolist()
+        self._axes = axes.tolist()
+
+    def __len__(self):
+        return len(self._node)
+
+    def nearest(self, coord, k=1, max_radius_m=None):
+        """
+        Finds the k nodes closest to a coordinate.
+
+        Args:
+            coord: (latitude, longitude) in decimal degrees.
+            k (int): How many nodes to return.
+            max_radius_m (float): Ignore nodes further away than this many metres.
+
+        Returns:
+            list: (distance in metres, node index) pairs, closest first. Can be shorter
+                  than k (or empty) when there are fewer nodes in range.
+        """
+        if k < 1 or not self._node:
+            return []
+
+        query = to_unit_sphere(coord[0], coord[1])
+        xs, ys, zs = self._coords
+        axes = self._axes
+        node = self._node
+
+        # Max-heap (negated) of the best k squared chord distances found so far
+        best = []
+        limit = float('inf') if max_radius_m is None else metres_to_chord(max_radius_m) ** 2
+
+        def consider(i):
+            nonlocal limit
+            dx = xs[i] - query[0]
+            dy = ys[i] - query[1]
+            dz = zs[i] - query[2]
+            d2 = dx * dx + dy * dy + dz * dz
+            if d2 <= limit:
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, node[i]))
+                else:
+                    heapq.heappushpop(best, (-d2, node[i]))
+                if len(best) == k:
+                    limit = min(limit, -best[0][0])
+
+        def search(lo, hi):
+            if hi - lo <= LEAF_SIZE:
+                for i in range(lo, hi):
+                    consider(i)
+                return
+
+            mid = (lo + hi) // 2
+            axis = axes[mid]
+            diff = query[axis] - (xs, ys, zs)[axis][mid]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+
+            search(*near)
+            consider(mid)
+            # The other side can only hold closer points if the splitting plane is in range
+            if diff * diff <= limit:
+                search(*far)
+
+        search(0, len(node))
+
+        results = sorted((-negative_d2, i) for negative_d2, i in best)
+        return [(chord_to_metres(math.sqrt(d2)), i) for d2, i in results]
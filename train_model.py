@@ -1,3 +1,6 @@
+import argparse
+import os
+
 from ultralytics import YOLO
 
 def train():
@@ -29,5 +32,49 @@ def train():
     print(f"Top-1 Accuracy: {metrics.top1}")
     print("Training complete. The best model is saved in 'road_safety_project/hazard_classifier/weights/best.pt'")
 
+def export_onnx(weights='road_safety_project/hazard_classifier2/weights/best.pt', int8=False):
+    """
+    Exports the trained model to ONNX so cv_inference.RoadScanner can run it with onnxruntime
+    (no torch needed). The file is written next to the weights (best.onnx).
+
+    Args:
+        weights (str): The trained .pt file.
+        int8 (bool): Also write an 8-bit quantized copy (best.int8.onnx), smaller and usually
+                     faster on CPUs. Check its scores against the full model before using it.
+
+    Returns:
+        str: Path of the ONNX file to use (the quantized one when int8=True).
+    """
+    model = YOLO(weights)
+    # dynamic=True lets one call score a whole batch of images
+    onnx_path = model.export(format='onnx', imgsz=model.overrides.get('imgsz', 224), dynamic=True)
+    print(f"Exported {onnx_path}")
+
+    if int8:
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.splitext(onnx_path)[0] + '.int8.onnx'
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+        # Tell RoadScanner to run it one image per call: dynamic quantization scales the
+        # activations per call, so batched scores would depend on the other images
+        quantized = onnx.load(int8_path)
+        onnx.helper.set_model_props(quantized, {**{p.key: p.value for p in quantized.metadata_props},
+                                                'quantization': 'dynamic'})
+        onnx.save(quantized, int8_path)
+        print(f"Quantized {int8_path}")
+        return int8_path
+    return onnx_path
+
 if __name__ == '__main__':
-    train()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Train the hazard classifier or export it to ONNX")
+    parser.add_argument('--export-onnx', metavar='WEIGHTS', nargs='?',
+                        const='road_safety_project/hazard_classifier2/weights/best.pt',
+                        help="Export trained weights to ONNX instead of training")
+    parser.add_argument('--int8', action='store_true', help="With --export-onnx, also write an int8 model")
+    args = parser.parse_args()
+
+    if args.export_onnx:
+        export_onnx(args.export_onnx, args.int8)
+    else:
+        train()
\ No newline at end of file
@@ -0,0 +1,100 @@
+# This file holds the named weighting profiles a route can be planned with. A profile only
+# changes how much a hazardous road is penalised (create_graph.build_graph's penalty factor):
+#   shortest - 0, the real distance
+#   balanced - PENALTY_FACTOR, the weights the graph was built with (the default)
+#   safest   - a much higher penalty, long detours to avoid hazards
+# Any other number can be given as a custom penalty factor.
+#
+# Every profile is one float column parallel to the graph's edge columns, computed from the
+# stored distance and safety_score in one vectorized step. shortest and balanced reuse the
+# distance and weight columns, so only safest (and each kept custom factor) costs memory.
+# Named profiles are kept in csr.derived until the weights change; custom factors are
+# recomputed for every search.
+
+import math
+import numbers
+from array import array
+
+import numpy as np
+
+from create_graph import PENALTY_FACTOR
+from csr_graph import as_csr
+from hazard_profile import profile_weights
+
+PROFILES = {
+    'shortest': 0.0,
+    'balanced': PENALTY_FACTOR,
+    'safest': 15.0,
+}
+DEFAULT_PROFILE = 'balanced'
+
+
+def penalty_factor(profile=None):
+    """
+    Returns the penalty factor of a profile name or a custom factor (number or numeric string).
+    None is the default profile. Raises ValueError for anything else.
+    """
+    if profile is None:
+        return PROFILES[DEFAULT_PROFILE]
+    # Checked before the lookup: lists, dicts, ... (e.g. from a JSON body) aren't hashable
+    if isinstance(profile, bool) or not isinstance(profile, (str, numbers.Real)):
+        raise ValueError(f"Unknown profile {profile!r}")
+    if profile in PROFILES:
+        return PROFILES[profile]
+    try:
+        penalty = float(profile)
+    except (TypeError, ValueError):
+        raise ValueError(f"Unknown profile {profile!r} (use {', '.join(PROFILES)} or a penalty factor)")
+    if not math.isfinite(penalty) or penalty < 0:
+        raise ValueError("A custom penalty factor must be a number of 0 or more")
+    return penalty
+
+
+def profile_name(profile=None):
+    # The name a profile is cached under: the named profile with the same factor, or the factor
+    # itself as a string (which penalty_factor reads back)
+    penalty = penalty_factor(profile)
+    for name, value in PROFILES.items():
+        if value == penalty:
+            return name
+    return f'{penalty:g}'
+
+
+def edge_weights(graph, profile=None, as_of_year=None):
+    """
+    The edge weights of a profile, for the weights argument of the searches.
+
+    Args:
+        graph: The built graph.
+        profile: Profile name or custom penalty factor (None = balanced).
+        as_of_year (int): Score the roads by the photos up to this year instead
+                          (see hazard_profile.profile_weights).
+
+    Returns:
+        One float per edge (the graph's own distance / weight column where they match).
+    """
+    csr = as_csr(graph)
+    penalty = penalty_factor(profile)
+    named = profile_name(profile) in PROFILES
+    if as_of_year is not None:
+        return profile_weights(csr, as_of_year, penalty, keep=named)
+    if penalty == PENALTY_FACTOR:
+        return csr.weight
+    if penalty == 0:
+        return csr.distance
+
+    key = ('profile', penalty)
+    weights = csr.derived.get(key)
+    if weights is None:
+        distance = np.asarray(csr.distance, dtype=np.float64)
+        values = distance * (1 + np.asarray(csr.safety_score, dtype=np.float64) * penalty)
+        weights = array('d', values.tobytes())
+        if named:
+            csr.derived[key] = weights
+    return weights
+
+
+def prepare_profiles(graph):
+    # Computes the named profiles up front (e.g. before forking web workers, so they share them)
+    for name in PROFILES:
+        edge_weights(graph, name)